@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Benchmark.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+from dnacbackend import DNACSession, STAGES
+from dnacexport import write_json_stream
+from main import exctract_validation_data
+from colorama import init, deinit, Fore
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def start_mock(scale, latency, task_duration):
+    """Run mockdnac.py in its own process so it does not compete for the GIL"""
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mockdnac.py'),
+         '--scale', str(scale), '--latency', str(latency),
+         '--task-duration', str(task_duration)],
+        stdout=subprocess.PIPE, universal_newlines=True)
+    line = mock.stdout.readline()
+    if not line.startswith('Mock DNA Center listening on port'):
+        mock.kill()
+        print(Fore.RED+"Mock DNA Center did not start"+Fore.RESET)
+        sys.exit(1)
+    return mock, int(line.rsplit(' ', 1)[1])
+
+def create_session(port, output_dir):
+    return DNACSession(
+        host='127.0.0.1',
+        port=port,
+        username='benchmark',
+        password='benchmark',
+        executer_name='benchmark',
+        executer_cco='benchmark',
+        config={
+            'scheme': 'http',
+            'ask_for_permission': False,
+            'token_cache': False,
+            'output_dir': output_dir,
+            'task_timeout': 3600,
+        })
+
+def measure(function, memory=True):
+    """Return wall time in seconds and peak traced memory in bytes of a call"""
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function()
+    elapsed = time.perf_counter() - started
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+def full_flow(session, output_dir):
+    """The main.py flow: all stages, validation data and the collected data file"""
+    session.run_stages()
+    json_data = session.get_params()
+    write_json_stream(
+        os.path.join(output_dir, 'dna-benchmark-extracted.json'),
+        exctract_validation_data(json_data))
+    write_json_stream(os.path.join(output_dir, 'dna-benchmark.json'), json_data)
+
+def run_scale(scale, arguments):
+    mock, port = start_mock(scale, arguments.latency, arguments.task_duration)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            session = create_session(port, output_dir)
+            for name, depends in STAGES:
+                collector = getattr(type(session), name).__wrapped__
+                session.shared.clear()
+                elapsed, peak = measure(lambda: collector(session), arguments.memory)
+                results.append({'scale': scale, 'case': name, 'seconds': elapsed, 'peak_bytes': peak})
+                print(Fore.GREEN+"---{0}x {1}: {2:.3f}s".format(scale, name, elapsed)+Fore.RESET)
+            session.close()
+
+            session = create_session(port, output_dir)
+            elapsed, peak = measure(lambda: full_flow(session, output_dir), arguments.memory)
+            results.append({'scale': scale, 'case': 'main', 'seconds': elapsed, 'peak_bytes': peak})
+            print(Fore.GREEN+"---{0}x main: {1:.3f}s".format(scale, elapsed)+Fore.RESET)
+            session.close()
+    finally:
+        mock.kill()
+        mock.wait()
+    return results
+
+def print_table(results):
+    print("{0:>6}  {1:<34} {2:>10} {3:>12}".format('scale', 'case', 'seconds', 'peak MiB'))
+    for result in results:
+        print("{0:>5}x  {1:<34} {2:>10.3f} {3:>12.1f}".format(
+            result['scale'], result['case'], result['seconds'],
+            result['peak_bytes'] / (1024 * 1024)))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Time and memory profile the collectors against a mock DNA Center")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100],
+                        help="data set scales to run [default 1 10 100]")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds the mock adds to every response [default 0]")
+    parser.add_argument('--task-duration', type=float, default=0.2,
+                        help="seconds until a mock task completes [default 0.2]")
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help="do not trace memory, tracing slows the collectors down")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    init()
+    results = []
+    for scale in arguments.scales:
+        print(Fore.CYAN+"-Benchmarking scale {0}x".format(scale)+Fore.RESET)
+        results.extend(run_scale(scale, arguments))
+    print_table(results)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+    deinit()
@@ -25,17 +25,520 @@ __version__ = "0.1.0"
 __copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import base64
+import codecs
+import collections
+import copy
+import functools
 import json
+import math
+import mmap
+import random
+import re
 import sys
 import os
 import requests
+import tempfile
+import threading
 import time
 import getpass
 import hashlib
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlparse
+from concurrent.futures import CancelledError, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from colorama import init, deinit, Fore, Back, Style
+from dnacmodel import FabricRoles, FabricSite, index_fabric_devices, fabric_site, json_default, unchanged_domain
+from dnacparse import parse_command_file, total_counts
+from dnactrace import Tracer
 
 requests.packages.urllib3.disable_warnings()
 
+# Collection stages in their sequential order, with the stages each one depends on
+STAGES = (
+    ('count_hosts', ()),
+    ('count_network_devices_inventory', ()),
+    ('fabric_domains_transits', ()),
+    ('fabric_inventory', ()),
+    ('show_commands', ('fabric_domains_transits',)),
+    ('count_images', ()),
+    ('run_upgrade_report', ()),
+    ('count_image_update_status', ()),
+)
+
+# what a number cut at a chunk boundary may still be followed by, e.g. "15000000000." or "1e"
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]+')
+
+
+def iter_json_array(chunks, key):
+    """Incrementally yield the items of the JSON array stored under key
+
+    chunks is an iterable of raw bytes (e.g. Response.iter_content). Only the
+    item being decoded is kept in memory, so arbitrarily large arrays are
+    parsed with bounded memory while they are still being downloaded. With
+    key None the document itself is the array, a null value under key is
+    an empty array. Raises ValueError when the key is missing or the
+    chunks end before the closing bracket.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    if key is not None:
+        array_start = re.compile(r'"{0}"\s*:\s*(\[|null\b)'.format(re.escape(key)))
+    buffer = ''
+    in_array = False
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        if not in_array and key is None:
+            buffer = buffer.lstrip()
+            if not buffer:
+                continue
+            if buffer[0] != '[':
+                raise ValueError("Expected a JSON array")
+            buffer = buffer[1:]
+            in_array = True
+        elif not in_array:
+            match = array_start.search(buffer)
+            if not match:
+                # keep a tail in case the key is split across chunks
+                buffer = buffer[-(len(key) + 256):]
+                continue
+            if match.group(1) == 'null':
+                return
+            buffer = buffer[match.end():]
+            in_array = True
+
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if buffer[position] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                break
+            # a number may go on in the next chunk, only a separator ends the item
+            following = end
+            while following < len(buffer) and buffer[following] in ' \t\r\n':
+                following += 1
+            if following == len(buffer) or NUMBER_TAIL.fullmatch(buffer, end):
+                break
+            if buffer[following] not in ',]':
+                raise ValueError("Unexpected data after a JSON array item")
+            yield item
+            position = end
+        buffer = buffer[position:]
+    utf8.decode(b'', final=True)
+    if not in_array:
+        raise ValueError("No JSON array found under {0}".format(key or 'the document'))
+    raise ValueError("JSON array ended before its closing bracket")
+
+def copy_chunks(chunks, file):
+    """Yield chunks while writing them to file"""
+    for chunk in chunks:
+        file.write(chunk)
+        yield chunk
+
+def response_items(data, key):
+    """Items of the array under key of a parsed response, data itself with key None"""
+    if key is None:
+        if not isinstance(data, list):
+            raise ValueError("Expected a JSON array")
+        return data
+    return data.get(key) or []
+
+class ResponseCache():
+    """Size-bounded on-disk cache of GET responses with a time to live
+
+    Every entry is one file named after the hash of the request URL. The first
+    line holds the JSON metadata, the rest is the raw body. File modification
+    times track the last use, so eviction drops the least recently used
+    entries once the cache grows above max_bytes.
+    """
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # responses hold inventory and client data, keep them private to the user
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        try:
+            os.chmod(directory, 0o700)
+        except OSError:
+            pass
+
+    def _path(self, url):
+        return os.path.join(
+            self.directory, hashlib.sha256(url.encode()).hexdigest())
+
+    def open(self, url):
+        """Entry file of url positioned at the body and its metadata, None when missing or expired"""
+        path = self._path(url)
+        try:
+            entry = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            meta = json.loads(entry.readline())
+            expired = time.time() - meta['stored'] > self.ttl
+        except (OSError, ValueError, KeyError):
+            entry.close()
+            return None
+        if expired:
+            entry.close()
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by another thread since it was opened, the open file is still good
+            pass
+        return entry, meta
+
+    def get(self, url):
+        """Cached response for url, None when missing or expired"""
+        opened = self.open(url)
+        if opened is None:
+            return None
+        entry, meta = opened
+        try:
+            with entry:
+                body = entry.read()
+        except OSError:
+            return None
+
+        r = requests.models.Response()
+        r.status_code = meta['status_code']
+        r.headers = requests.structures.CaseInsensitiveDict(meta['headers'])
+        r.encoding = meta['encoding']
+        r.url = url
+        r._content = body
+        r.from_cache = True
+        return r
+
+    def put(self, url, r):
+        """Store a response and evict the least recently used entries"""
+        entry, temp_path = self.create(r)
+        with entry:
+            entry.write(r.content)
+        self.commit(url, temp_path)
+
+    def create(self, r):
+        """Temporary entry file for the response r with its metadata written
+
+        The caller writes the body, closes the file and hands it to commit(),
+        or removes it when the body could not be read to the end.
+        """
+        meta = {
+            'stored': time.time(),
+            'status_code': r.status_code,
+            'headers': dict(r.headers),
+            'encoding': r.encoding,
+        }
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        entry = os.fdopen(handle, 'wb')
+        entry.write(json.dumps(meta).encode() + b'\n')
+        return entry, temp_path
+
+    def commit(self, url, temp_path):
+        """Make a written temporary entry the entry of url"""
+        with self.lock:
+            os.replace(temp_path, self._path(url))
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for item in os.scandir(self.directory):
+            if item.name.endswith('.tmp'):
+                # still being written
+                continue
+            try:
+                if not item.is_file(follow_symlinks=False):
+                    continue
+                stat = item.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, item.name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.directory, name))
+            total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class StageJournal():
+    """Append-only journal of completed collection stages, one JSON line each"""
+    def __init__(self, path, host):
+        self.path = path
+        self.host = host
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Results of the stages recorded for this host, by stage name"""
+        completed = {}
+        try:
+            with open(self.path, 'r') as journal_file:
+                header = json.loads(journal_file.readline())
+                if header.get('host') != self.host:
+                    return completed
+                for line in journal_file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a stage interrupted while being recorded
+                        continue
+                    completed[entry['stage']] = entry['result']
+        except (OSError, ValueError):
+            pass
+        return completed
+
+    def start(self, append=False):
+        """Open the journal, starting a new one unless resuming"""
+        if not append:
+            with open(self.path, 'w') as journal_file:
+                journal_file.write(json.dumps({'host': self.host}) + '\n')
+
+    def record(self, name, result):
+        """Append a completed stage and flush it to disk"""
+        line = json.dumps({'stage': name, 'result': result}, default=json_default)
+        with self.lock:
+            with open(self.path, 'a') as journal_file:
+                journal_file.write(line + '\n')
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class TokenManager():
+    """Keeps a valid auth token for one host and user
+
+    Tokens are reused between runs through a cache file readable only by the
+    current user, refreshed refresh_margin seconds ahead of their expiry and
+    replaced straight away when the appliance rejects them.
+    """
+    def __init__(self, login, key, cache_path=None, refresh_margin=300, lifetime=3600):
+        self.login = login
+        self.key = hashlib.sha256(key.encode()).hexdigest()
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.token = None
+        self.expires = 0
+        if cache_path:
+            entry = self._read_cache().get(self.key)
+            if entry and entry['expires'] - refresh_margin > time.time():
+                self.token = entry['token']
+                self.expires = entry['expires']
+
+    @staticmethod
+    def token_expiry(token):
+        """Expiry time stored in the JWT 'exp' claim, None when unknown"""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def get(self):
+        """Current token, refreshed when it is about to expire"""
+        with self.lock:
+            if self.token is None or time.time() >= self.expires - self.refresh_margin:
+                self._refresh()
+            return self.token
+
+    def invalidate(self, token):
+        """Replace a token rejected by the appliance, once for all waiting workers"""
+        with self.lock:
+            if token == self.token:
+                self._refresh()
+            return self.token
+
+    def _refresh(self):
+        self.token = self.login()
+        self.expires = self.token_expiry(self.token) or time.time() + self.lifetime
+        if self.cache_path:
+            self._write_cache()
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_path, 'r') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self):
+        now = time.time()
+        entries = {key: entry for key, entry in self._read_cache().items()
+                   if entry.get('expires', 0) > now}
+        entries[self.key] = {'token': self.token, 'expires': self.expires}
+        directory = os.path.dirname(self.cache_path)
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            temp_path = self.cache_path + '.{0}.tmp'.format(os.getpid())
+            handle = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(handle, 'w') as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as error:
+            print(Fore.YELLOW+"---Could not cache auth token: {0}".format(error)+Fore.RESET)
+
+
+# Family no device has, a count filtered by it is 0 only when the filter is honoured
+NO_SUCH_FAMILY = 'activationcheck-no-such-family'
+
+def with_query(url, query=None):
+    """Append query parameters to an url that may already have some"""
+    if not query:
+        return url
+    return url + ('&' if '?' in url else '?') + urlencode(query)
+
+HEALTH_URL = '/api/assurance/v1/host/dash/healthdetail'
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted values"""
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
+
+def summarize_samples(values):
+    """Peak, mean and percentiles of sampled counts"""
+    values = sorted(values)
+    return {
+        'peak': values[-1],
+        'mean': round(sum(values) / len(values), 1),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+    }
+
+# Replies telling the client to slow down, the request is sent again
+THROTTLE_STATUS = (429, 503)
+
+def endpoint_class(url):
+    """Rate limiting class of an API url: assurance, task (polling) or intent"""
+    path = urlparse(url).path
+    if path.startswith('/api/assurance/'):
+        return 'assurance'
+    if path.startswith(('/api/v1/task/', '/api/v1/file/')):
+        return 'task'
+    return 'intent'
+
+def retry_after_seconds(value):
+    """Seconds to wait from a Retry-After header (seconds or HTTP date), None if unusable"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter():
+    """Token bucket shared by every worker sending one class of requests
+
+    rate tokens per second are added up to burst. When the appliance
+    throttles, the bucket is paused for the requested delay and its rate
+    halved; every accepted request then wins back part of the configured
+    rate, so throughput settles at what the appliance allows.
+    """
+    def __init__(self, rate, burst):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + max(now - self.updated, 0) * self.rate)
+                self.updated = max(self.updated, now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+
+    def throttled(self, delay):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.updated = self.paused_until
+            self.tokens = 0.0
+            self.rate = max(self.rate / 2, self.max_rate / 16)
+
+    def accepted(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class JobManager():
+    """Server-side jobs started in the background at the beginning of a run
+
+    A job submits work to the appliance, waits for it and fetches its
+    result on its own thread while the collectors run. The stage owning
+    the job picks the result up with result(), or does the work itself
+    when the job was never started. Jobs run on a session view whose
+    stop_event is stopped, shutdown() sets it so that jobs still waiting
+    on the appliance give up at their next poll.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.futures = {}
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, name, function):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.futures[name] = self.executor.submit(function)
+
+    def result(self, name, function):
+        """Result of the background job name, or of function when it was not started"""
+        with self.lock:
+            future = self.futures.pop(name, None)
+        if future is None:
+            return function()
+        return future.result()
+
+    def shutdown(self):
+        """Stop and forget the jobs whose result was not picked up"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+            if self.futures:
+                # running jobs keep the event they were started with
+                self.stopped.set()
+                self.stopped = threading.Event()
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+        if executor:
+            executor.shutdown(wait=False)
+
 
 class DNACSession():
     def __init__(
@@ -45,6 +548,9 @@ class DNACSession():
         username=None,
         password=None,
         token=None,
+        config=None,
+        executer_name=None,
+        executer_cco=None,
     ):
         if host:
             self.host = host
@@ -61,8 +567,97 @@ class DNACSession():
             'show_token': False,
             'string_mask': '*' * 5,
             'ask_for_permission': True,
+            'pool_connections': 4,
+            'pool_maxsize': 16,
+            'pool_block': True,
+            'keep_alive': True,
+            'stage_workers': 4,
+            'site_workers': 8,
+            'inventory_page_size': 500,
+            'inventory_prefetch': True,
+            'stream_json': True,
+            'stream_chunk_size': 64 * 1024,
+            'command_runner_batch_size': 100,
+            'command_runner_workers': 4,
+            'poll_initial_delay': 0.5,
+            'poll_backoff': 1.6,
+            'poll_max_delay': 10,
+            'task_timeout': 300,
+            'poll_workers': 8,
+            'file_timeout': 60,
+            'cache_enabled': False,
+            'cache_bypass': False,
+            'cache_dir': os.path.join(
+                os.path.dirname(os.path.abspath(sys.argv[0])), '.dnac-cache'),
+            'health_cache_dir': os.path.join(
+                os.path.dirname(os.path.abspath(sys.argv[0])), '.dnac-health-cache'),
+            'output_dir': os.path.dirname(os.path.abspath(sys.argv[0])),
+            'scheme': 'https',
+            'cache_ttl': 900,
+            'cache_max_bytes': 256 * 1024 * 1024,
+            'token_cache': True,
+            'token_cache_path': os.path.join(
+                os.path.expanduser('~'), '.dnac-activationcheck', 'tokens.json'),
+            'token_refresh_margin': 300,
+            'token_lifetime': 3600,
+            'counters_only': False,
+            'download_prefix': '',
+            'trace': False,
+            'trace_memory': True,
+            # requests per second and burst size for each endpoint class
+            'rate_limits': {
+                'intent': (50, 50),
+                'assurance': (10, 10),
+                'task': (50, 100),
+            },
+            'throttle_retries': 8,
+            'server_filters': True,
+            'health_lookback': 0,
+            'health_window': 300,
+            'health_samples': 48,
+            'health_workers': 8,
+            'health_cache': True,
+            'health_cache_ttl': 30 * 24 * 3600,
+            'health_settle': 900,
+            'spill_threshold': 8 * 1024 * 1024,
+            'spill_dir': None,
+            'background_jobs': True,
+            'job_workers': 2,
+            'parse_show_commands': True,
+            'keep_raw_output': True,
         }
-
+        if config:
+            self.config.update(config)
+
+        self.tracer = Tracer(self.config['trace'], self.config['trace_memory'])
+
+        self.http = self._create_http_session()
+
+        self.shared = {}
+        self.shared_locks = {}
+        self.shared_lock = threading.Lock()
+        self.jobs = JobManager(self.config['job_workers'])
+        self.stop_event = None
+
+        self.cache = None
+        if self.config['cache_enabled']:
+            self.cache = ResponseCache(
+                self.config['cache_dir'],
+                self.config['cache_ttl'],
+                self.config['cache_max_bytes'])
+
+        self.health_cache = None
+        if self.config['health_lookback'] and self.config['health_cache']:
+            self.health_cache = ResponseCache(
+                self.config['health_cache_dir'],
+                self.config['health_cache_ttl'],
+                self.config['cache_max_bytes'])
+
+        self.limiters = {
+            name: RateLimiter(rate, burst)
+            for name, (rate, burst) in (self.config['rate_limits'] or {}).items()}
+
+        self.tokens = None
         if not token:
             if username:
                 self.username = username
@@ -75,20 +670,30 @@ class DNACSession():
                 self.set_password()
 
             if self.login_ack():
-                self.token = self.get_auth_token()
+                self.tokens = TokenManager(
+                    self.get_auth_token,
+                    '{0}:{1}:{2}'.format(self.host, self.port, self.username),
+                    self.config['token_cache_path'] if self.config['token_cache'] else None,
+                    self.config['token_refresh_margin'],
+                    self.config['token_lifetime'])
+                self.token = self.tokens.get()
             else:
                 sys.exit(1)
         else:
             self.token = token
 
-        self.set_identity()
+        if executer_name is not None and executer_cco is not None:
+            self.params['executer_name'] = executer_name
+            self.params['executer_cco'] = executer_cco
+        else:
+            self.set_identity()
+        self.params['host'] = self.host
 
-        self.requests_headers = {
-            'X-auth-token': self.token
-        }
+        self.previous = None
+        self.previous_name = None
+        self.previous_fabric = {}
 
         self.post_headers = {
-            'X-auth-token': self.token,
             'Content-Type': 'application/json'
         }
 
@@ -123,29 +728,39 @@ class DNACSession():
     def get_epoch_time(self):
         self.epoch_time = int(time.time())*1000
 
+    def confirm(self, message):
+        """Ask the user for a yes/no decision, always 'yes' when asking is disabled"""
+        if not self.config['ask_for_permission']:
+            return True
+        opt_yes = ['y', 'yes']
+        opt_no = ['n', 'no']
+        print(message)
+        while True:
+            print("Please use {tfyes}[{yes}]{tfreset} for 'yes' or {tfno}[{no}]{tfreset} for 'no'. [default {tfyes}'yes'{tfreset}]".format(
+                yes="/".join(opt_yes),
+                no="/".join(opt_no),
+                tfyes=Fore.GREEN,
+                tfno=Fore.RED,
+                tfreset=Fore.RESET
+            ))
+            decision = input()
+            if decision.lower() in opt_yes or decision == '':
+                return True
+            elif decision.lower() in opt_no:
+                return False
+            print("Decision unknown!")
+
     def ask_for_permision(message):
         """Decision decorator, askes for confirmation before running an API function"""
         def _decorator(function):
+            @functools.wraps(function)
             def wrapper(self):
-                if self.config['ask_for_permission']:
-                    opt_yes = ['y', 'yes']
-                    opt_no = ['n', 'no']
-                    print(message)
-                    while True:
-                        print("Please use {tfyes}[{yes}]{tfreset} for 'yes' or {tfno}[{no}]{tfreset} for 'no'. [default {tfyes}'yes'{tfreset}]".format(
-                            yes="/".join(opt_yes),
-                            no="/".join(opt_no),
-                            tfyes=Fore.GREEN,
-                            tfno=Fore.RED,
-                            tfreset=Fore.RESET
-                        ))
-                        decision = input()
-                        if decision.lower() in opt_yes or decision == '':
-                            function(self)
-                            return True
-                        elif decision.lower() in opt_no:
-                            return False
-                        print("Decision unknown!")
+                if self.confirm(message):
+                    with self.tracer.stage(function.__name__):
+                        function(self)
+                    return True
+                return False
+            wrapper.permission_message = message
             return wrapper
         return _decorator
 
@@ -163,23 +778,78 @@ class DNACSession():
         self.config['show_token'] = flag
 
     def set_ask_for_permission(self, flag=True):
-        self.config[ask_for_permission] = flag
+        self.config['ask_for_permission'] = flag
+
+    def _create_http_session(self):
+        """Create the pooled HTTP session shared by every API call"""
+        http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.config['pool_connections'],
+            pool_maxsize=self.config['pool_maxsize'],
+            pool_block=self.config['pool_block'])
+        http.mount('https://', adapter)
+        http.mount('http://', adapter)
+        http.verify = self.config['request_verify']
+        http.headers['Connection'] = 'keep-alive' if self.config['keep_alive'] else 'close'
+        return http
+
+    def connection_stats(self):
+        """Report how many requests were served over reused connections"""
+        stats = {'requests': 0, 'connections': 0, 'reused': 0}
+        for adapter in set(self.http.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                stats['requests'] += pool.num_requests
+                stats['connections'] += pool.num_connections
+        stats['reused'] = max(stats['requests'] - stats['connections'], 0)
+        stats['reuse_ratio'] = round(
+            stats['reused'] / stats['requests'], 3) if stats['requests'] else 0.0
+        return stats
+
+    def close(self):
+        """Release pooled connections"""
+        self.http.close()
 
     def _create_url(self, url):
         host = self.host + ':' + \
             str(self.port) if self.port != 80 else self.host
-        return "https://{host}{url}".format(host=host, url=url)
-
-    def _get_url(self, url):
+        return "{scheme}://{host}{url}".format(
+            scheme=self.config['scheme'], host=host, url=url)
+
+    def _get_url(self, url, stream=False, cache=True, headers=None, exit_on_error=True):
+        """GET an API url, served from the response cache when enabled
+
+        Streamed responses and calls made with cache=False (task and file
+        polling) always go to the appliance. With 'cache_bypass' set responses
+        are fetched again but still refresh the cache. With exit_on_error
+        unset a bad response is returned to the caller instead of exiting.
+        Every call is recorded by the tracer when tracing is enabled.
+        """
         # TO DO HTTP error handling
+        url = self._create_url(url)
+        with self.tracer.request('GET', url) as call:
+            r = self._get_url_response(url, stream, cache, headers, exit_on_error)
+            if call:
+                call.set_response(r, stream, cached=getattr(r, 'from_cache', False))
+            return r
+
+    def _get_url_response(self, url, stream, cache, headers, exit_on_error):
         try:
-            url = self._create_url(url)
+            use_cache = self.cache is not None and cache and not stream
+            if use_cache and not self.config['cache_bypass']:
+                r = self.cache.get(url)
+                if r is not None:
+                    return r
             #print("Sending get request to {url}".format(url=url))
-            r = requests.get(
-                url=url,
-                headers=self.requests_headers,
-                verify=self.config['request_verify'])
-            if r.status_code == 200 or r.status_code == 204:
+            r = self._send('GET', url, headers=headers, stream=stream)
+            if r.status_code == 200 or r.status_code == 204 or r.status_code == 206:
+                if use_cache and r.status_code == 200:
+                    self.cache.put(url, r)
+                return r
+            elif not exit_on_error:
                 return r
             else:
                 print("Error bad response", r.status_code, r.text)
@@ -188,30 +858,124 @@ class DNACSession():
             print("Error processing request", cerror)
             sys.exit(1)
 
+    def iter_response_items(self, url, key='response', cache=True):
+        """Yield the items of the JSON array under key in an API response
+
+        Bodies are read decoded, compressed on the wire as the appliance
+        sends them, into memory up to 'spill_threshold' bytes. A body that
+        grows above it is streamed on to a temporary file, which frees the
+        connection at once, and parsed item by item from a memory-mapped
+        view of it, so the body is never held as a whole in Python bytes or
+        str. Smaller bodies, and all bodies while the response cache is on,
+        are parsed in memory. With key None the body itself is the array.
+        """
+        threshold = self.config['spill_threshold']
+        if not threshold or (self.cache is not None and cache):
+            data = self._get_url(url, cache=cache).json()
+            for item in response_items(data, key):
+                yield item
+            return
+
+        r = self._get_url(url, stream=True, cache=False)
+        chunk_size = self.config['stream_chunk_size']
+        try:
+            chunks = r.iter_content(chunk_size=chunk_size)
+            body = bytearray()
+            for chunk in chunks:
+                body += chunk
+                if len(body) > threshold:
+                    break
+            else:
+                r.close()
+                for item in response_items(json.loads(body), key):
+                    yield item
+                return
+
+            with tempfile.TemporaryFile(dir=self.config['spill_dir']) as spill:
+                spill.write(body)
+                del body
+                for chunk in chunks:
+                    spill.write(chunk)
+                r.close()
+                spill.flush()
+                size = spill.tell()
+                with mmap.mmap(spill.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    chunks = (view[offset:offset + chunk_size] for offset in range(0, size, chunk_size))
+                    for item in iter_json_array(chunks, key):
+                        yield item
+        finally:
+            r.close()
+
     def _post_url(self, url, payload):
         # TO DO HTTP error handling
         try:
             url = self._create_url(url)
             #print("Sending get request to {url}".format(url=url))
             payload = json.dumps(payload)
-            return requests.post(
-                url=url,
-                headers=self.post_headers,
-                data=payload,
-                verify=self.config['request_verify'])
+            with self.tracer.request('POST', url) as call:
+                r = self._send(
+                    'POST', url, headers=self.post_headers, data=payload)
+                if call:
+                    call.bytes_sent = len(payload)
+                    call.set_response(r)
+                return r
         except requests.exceptions.RequestException as cerror:
             print(Fore.RED+"Error processing request"+Fore.RESET, cerror)
             sys.exit(1)
 
+    def _send(self, method, url, headers=None, **kwargs):
+        """Send an authenticated request through the rate limiter of its endpoint class
+
+        Authenticates again once on 401. A 429 or 503 reply pauses the
+        endpoint class for Retry-After (or the next poll delay when there is
+        none) and the request is sent again, up to 'throttle_retries' times.
+        """
+        token = self.tokens.get() if self.tokens else self.token
+        self.token = token
+        headers = dict(headers or {})
+        headers['X-auth-token'] = token
+        limiter = self.limiters.get(endpoint_class(url))
+        reauthenticated = False
+        throttled = 0
+        delays = None
+        while True:
+            if limiter:
+                limiter.acquire()
+            r = self.http.request(method, url, headers=headers, **kwargs)
+            if r.status_code == 401 and self.tokens and not reauthenticated:
+                r.close()
+                print(Fore.YELLOW+"---Token rejected, authenticating again"+Fore.RESET)
+                self.tracer.retry()
+                headers['X-auth-token'] = self.token = self.tokens.invalidate(token)
+                reauthenticated = True
+                continue
+            if r.status_code not in THROTTLE_STATUS or throttled >= self.config['throttle_retries']:
+                break
+            delay = retry_after_seconds(r.headers.get('Retry-After'))
+            if delay is None:
+                delays = delays or self._poll_delays()
+                delay = next(delays)
+            r.close()
+            throttled += 1
+            print(Fore.YELLOW+"---Throttled by the appliance ({0}), retrying in {1:.1f}s".format(
+                r.status_code, delay)+Fore.RESET)
+            self.tracer.retry()
+            if limiter:
+                limiter.throttled(delay)
+            else:
+                time.sleep(delay)
+        if limiter and r.status_code not in THROTTLE_STATUS:
+            limiter.accepted()
+        return r
+
     def get_auth_token(self):
         """Retrieve auth token to be used in futer API calls"""
-        # login_url = "https://{0}/dna/system/api/v1/auth/token".format(
-        login_url = "https://{0}/api/system/v1/auth/token".format(
-            self.host, self.port)
+        # login_url = self._create_url('/dna/system/api/v1/auth/token')
+        login_url = self._create_url('/api/system/v1/auth/token')
         try:
-            result = requests.post(
+            result = self.http.post(
                 url=login_url, auth=requests.auth.HTTPBasicAuth(
-                    self.username, self.password), verify=False)
+                    self.username, self.password))
             result.raise_for_status()
         except requests.exceptions.HTTPError as err:
             print("Http Error: ", err)
@@ -244,38 +1008,176 @@ class DNACSession():
             '/api/v1/topology/physical-topology?nodeType=HOST')
         return r.json().get('response')
 
+    def iter_hosts(self):
+        """Stream system hosts (wired and wireless), parsing nodes as they arrive
+
+        With the response cache on, a fresh entry is parsed from disk the
+        same way. Otherwise the body is copied into a new entry while it is
+        streamed, which replaces the old one once the hosts were read to the
+        closing bracket.
+        """
+        print(Fore.GREEN+"---Streaming system hosts"+Fore.RESET)
+        url = '/api/v1/topology/physical-topology?nodeType=HOST'
+        chunk_size = self.config['stream_chunk_size']
+        if self.cache is not None and not self.config['cache_bypass']:
+            opened = self.cache.open(self._create_url(url))
+            if opened is not None:
+                with opened[0] as entry:
+                    for host in iter_json_array(iter(lambda: entry.read(chunk_size), b''), 'nodes'):
+                        yield host
+                return
+
+        r = self._get_url(url, stream=True)
+        entry = temp_path = None
+        if self.cache is not None and r.status_code == 200:
+            entry, temp_path = self.cache.create(r)
+        try:
+            chunks = r.iter_content(chunk_size=chunk_size)
+            if entry is not None:
+                chunks = copy_chunks(chunks, entry)
+            for host in iter_json_array(chunks, 'nodes'):
+                yield host
+            if entry is not None:
+                for chunk in chunks:
+                    pass
+                entry.close()
+                self.cache.commit(self._create_url(url), temp_path)
+                entry = None
+        finally:
+            r.close()
+            if entry is not None:
+                entry.close()
+                ResponseCache._remove(temp_path)
+
     @ask_for_permision('--Do you want to count wired and wireless hosts?')
     def count_hosts(self):
         """Counting wired and wireless host/clients"""
         print(Fore.GREEN+"---Counting system hosts"+Fore.RESET)
-        hosts = self.get_hosts().get('nodes')
-        wired_hosts = [host for host in hosts if host['deviceType'] == 'wired']
-        wireless_hosts = [
-            host for host in hosts if host['deviceType'] == 'wireless']
-        self.params['wired_hosts_count'] = len(wired_hosts)
-        self.params['wireless_hosts_count'] = len(wireless_hosts)
+        if self.config['stream_json']:
+            hosts = self.iter_hosts()
+        else:
+            hosts = self.get_hosts().get('nodes')
+        device_types = collections.Counter(host.get('deviceType') for host in hosts)
+        self.params['wired_hosts_count'] = device_types['wired']
+        self.params['wireless_hosts_count'] = device_types['wireless']
 
         self._count_hosts_via_sitehealt()
 
+    def iter_network_devices_inventory(self):
+        """Stream the inventory of network devices page by page (offset/limit)
+
+        While the devices of one page are consumed the next page is already
+        being fetched when 'inventory_prefetch' is set. The appliance may cap
+        the page below the limit asked for, so the offset moves by the devices
+        returned and an empty page ends the inventory. Appliances ignoring
+        offset and limit return everything on every page: a page above the
+        limit, or starting with the same device as the page before, ends it.
+        """
+        print(Fore.GREEN+"---Retrieving network devices inventory list"+Fore.RESET)
+        page_size = self.config['inventory_page_size']
+
+        def get_page(offset):
+            r = self._get_url(
+                # '/dna/intent/api/v1/topology/physical-topology?nodeType=device')
+                '/api/v1/network-device?offset={0}&limit={1}'.format(offset, page_size))
+            return r.json().get('response') or []
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            offset = 1
+            first_id = None
+            page = executor.submit(get_page, offset)
+            while page is not None:
+                devices = page.result()
+                page = None
+                if devices and first_id is not None and devices[0].get('id') == first_id:
+                    return
+                if devices and len(devices) <= page_size:
+                    first_id = devices[0].get('id')
+                    offset += len(devices)
+                    page = executor.submit(get_page, offset)
+                    if not self.config['inventory_prefetch']:
+                        page.result()
+                for device in devices:
+                    yield device
+
     def get_network_devices_inventory(self):
         """Retreive inventory of network devices"""
-        print(Fore.GREEN+"---Retrieving network devices inventory list"+Fore.RESET)
-        r = self._get_url(
-            # '/dna/intent/api/v1/topology/physical-topology?nodeType=device')
-            '/api/v1/network-device/')
-        return r.json().get('response')
+        return list(self.iter_network_devices_inventory())
+
+    def get_filtered(self, url, query, predicate):
+        """Retrieve the items of a collection matching query and predicate
+
+        The query is sent to the appliance so it only returns the matching
+        items. Appliances that ignore it return everything, so the predicate
+        is applied here as well; when the filtered request is rejected the
+        whole collection is retrieved instead.
+        """
+        r = None
+        if self.config['server_filters']:
+            r = self._get_url(with_query(url, query), exit_on_error=False)
+            if r.status_code not in (200, 204):
+                print(Fore.YELLOW+"---Filtering not supported, retrieving all items"+Fore.RESET)
+                r = None
+        if r is None:
+            r = self._get_url(url)
+        return [item for item in r.json().get('response') if predicate(item)]
+
+    def get_count(self, url, query=None):
+        """Value of a count endpoint, None when the appliance does not provide it"""
+        r = self._get_url(with_query(url, query), exit_on_error=False)
+        if r.status_code != 200:
+            return None
+        try:
+            count = r.json().get('response')
+        except (ValueError, AttributeError):
+            return None
+        return count if isinstance(count, int) and not isinstance(count, bool) else None
+
+    def count_network_devices_by_family(self, families):
+        """Total and per family device counts from the count endpoint
+
+        The family filter is probed first with a family no device has: an
+        appliance ignoring the filter answers with the total. Returns None
+        when counting has to be done on the inventory list.
+        """
+        if not self.config['server_filters']:
+            return None
+        url = '/api/v1/network-device/count'
+        total = self.get_count(url)
+        if total is None or self.get_count(url, {'family': NO_SUCH_FAMILY}) != 0:
+            return None
+        counts = {}
+        for family in families:
+            counts[family] = self.get_count(url, {'family': family})
+            if counts[family] is None:
+                return None
+        return total, counts
 
     @ask_for_permision('--Do you wnat to count devices in inventory?')
     def count_network_devices_inventory(self):
         """Count devices in inventory of network devices"""
         print(Fore.GREEN+"---Counting network devices"+Fore.RESET)
-        devices_inventory = self.get_network_devices_inventory()
-        wlc_count = sum(
-            [item['family'] == 'Wireless Controller' for item in devices_inventory])
-        ap_count = sum(
-            [item['family'] == 'Unified AP' for item in devices_inventory])
+        counted = self.count_network_devices_by_family(('Wireless Controller', 'Unified AP'))
+        if counted is not None:
+            inventory_total, counts = counted
+            self.params['devices_inventory'] = {
+                'inventory_total': inventory_total,
+                'wlc_count': counts['Wireless Controller'],
+                'ap_count': counts['Unified AP'],
+            }
+            return
+
+        inventory_total = 0
+        wlc_count = 0
+        ap_count = 0
+        for item in self.iter_network_devices_inventory():
+            inventory_total += 1
+            if item['family'] == 'Wireless Controller':
+                wlc_count += 1
+            elif item['family'] == 'Unified AP':
+                ap_count += 1
         self.params['devices_inventory'] = {
-            'inventory_total': len(devices_inventory),
+            'inventory_total': inventory_total,
             'wlc_count': wlc_count,
             'ap_count': ap_count,
         }
@@ -284,9 +1186,8 @@ class DNACSession():
         """Retrieving inventory of fabric domains and transits"""
         print(
             Fore.GREEN+"---Retrieving fabric domains and transits inventory list"+Fore.RESET)
-        r = self._get_url(
-            '/api/v2/data/customer-facing-service/ConnectivityDomain')
-        return r.json().get('response')
+        return list(self.iter_response_items(
+            '/api/v2/data/customer-facing-service/ConnectivityDomain'))
 
     def get_fabric_inventory_by_site(self, site_id):
         """Retrieving fabric devices inventory by site"""
@@ -303,11 +1204,70 @@ class DNACSession():
             '/api/v2/ippool?contextvalue={0}'.format(siteid))
         return r.json().get('response')
 
+    def set_previous_snapshot(self, snapshot, name=None):
+        """Collected data of an earlier run, fabric sites unchanged since are taken from it"""
+        self.previous = snapshot
+        self.previous_name = name
+        self.previous_fabric = {
+            id: fabric_site(site) for id, site in snapshot.get('fabric', {}).items()}
+
+    def get_shared_fabric_domains(self):
+        """ConnectivityDomain list, fetched once and shared between stage workers"""
+        return self.run_once('fabric_domains', self.get_fabric_domains_transits)
+
+    def changed_fabric_domains(self):
+        """Ids of the fabric domains changed since the previous snapshot, None without one
+
+        Domains are compared by their ConnectivityDomain change markers, new
+        and removed domains count as changed.
+        """
+        if self.previous is None:
+            return None
+
+        def compare():
+            domains = self.get_shared_fabric_domains()
+            changed = set(
+                item["id"] for item in domains
+                if not unchanged_domain(self.previous_fabric.get(item["id"]), item))
+            return changed | (set(self.previous_fabric) - set(item["id"] for item in domains))
+        return self.run_once('fabric_changes', compare)
+
+    def run_once(self, key, function):
+        """Run function once per session and share its result between stage workers"""
+        with self.shared_lock:
+            lock = self.shared_locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self.shared:
+                self.shared[key] = function()
+            return self.shared[key]
+
+    def get_fabric_index(self):
+        """Global fabric devices inventory indexed by site and role, fetched once"""
+        return self.run_once(
+            'fabric_index', lambda: index_fabric_devices(self.iter_fabric_inventory()))
+
+    def get_fabric_site_roles(self, site_id):
+        """Fabric devices of a single site by role, from the global index when possible"""
+        index = self.get_fabric_index()
+        if index is not None:
+            return index['sites'].get(site_id, FabricRoles())
+        roles = FabricRoles()
+        for item_site in self.get_fabric_inventory_by_site(site_id):
+            if "roles" in item_site:
+                roles.add_item(item_site)
+        return roles
+
+    def get_fabric_site_details(self, site_id):
+        """Retrieving fabric pool ids and devices by role of a single site"""
+        return (self.get_fabric_site_poolids(site_id),
+                self.get_fabric_site_roles(site_id))
+
     @ask_for_permision('--Do you want to count SDA domains?')
     def fabric_domains_transits(self):
         """Fabric domains, transits and vns"""
         print(Fore.GREEN+"---Analyzing fabric and extracting relevant numbers"+Fore.RESET)
-        fabric_domains_transits = self.get_fabric_domains_transits()
+        counters_only = self.config['counters_only']
+        fabric_domains_transits = self.get_shared_fabric_domains()
         self.params['fabric_lans_count'] = sum(
             1 for item in fabric_domains_transits if item["domainType"] == "FABRIC_LAN")
         self.params['fabric_sites_count'] = sum(
@@ -318,107 +1278,81 @@ class DNACSession():
         self.params['fabric'] = {}
 
         for item in fabric_domains_transits:
-            item_id = item["id"]
-            self.params['fabric'][item_id] = {}
-            self.params['fabric'][item_id]["vn_count"] = len(
-                item["virtualNetwork"])
-            self.params['fabric'][item_id]["name"] = item["name"]
-            self.params['fabric'][item_id]["fabric_details"] = item
-
-            """Gather fabric site ip pool"""
-            if "siteId" in self.params['fabric'][item_id]["fabric_details"]:
-                ip_pools = self.get_fabric_site_poolids(
-                    self.params['fabric'][item_id]["fabric_details"]["siteId"])
-                self.params['fabric'][item["id"]]["ippool"] = ip_pools
-
-            """Gather fabric devices inventory"""
-            self.params['fabric'][item_id]["devices"] = []
-            self.params['fabric'][item_id]["edge"] = []
-            self.params['fabric'][item_id]["control"] = []
-            self.params['fabric'][item_id]["border"] = []
-            #self.params['fabric'][item_id]["device_details"] = []
-
-            if "siteId" in self.params['fabric'][item["id"]]["fabric_details"]:
-                fabric_by_site = self.get_fabric_inventory_by_site(
-                    self.params['fabric'][item_id]["fabric_details"]["siteId"])
-                for item_site in fabric_by_site:
-                    if "roles" in item_site:
-                        if "EDGENODE" in item_site["roles"]:
-                            self.params['fabric'][item_id]["edge"].append(
-                                item_site["networkDeviceId"])
-                            self.params['fabric'][item_id]["devices"].append(
-                                item_site["networkDeviceId"])
-                            # self.params['fabric'][item_id]["device_details"].append(item_site)
-                        if "MAPSERVER" in item_site["roles"]:
-                            self.params['fabric'][item_id]["control"].append(
-                                item_site["networkDeviceId"])
-                            self.params['fabric'][item_id]["devices"].append(
-                                item_site["networkDeviceId"])
-                            # self.params['fabric'][item_id]["device_details"].append(item_site)
-                        if "BORDERNODE" in item_site["roles"]:
-                            self.params['fabric'][item_id]["border"].append(
-                                item_site["networkDeviceId"])
-                            self.params['fabric'][item_id]["devices"].append(
-                                item_site["networkDeviceId"])
-                            # self.params['fabric'][item_id]["device_details"].append(item_site)
+            self.params['fabric'][item["id"]] = FabricSite(
+                item["name"],
+                len(item["virtualNetwork"]),
+                item["domainType"],
+                None if counters_only else item)
+
+        """Gather fabric site ip pools and devices inventory, site by site in parallel"""
+        site_items = [item for item in fabric_domains_transits if "siteId" in item]
+        changed = self.changed_fabric_domains()
+        if changed is not None:
+            reused = [item["id"] for item in site_items if item["id"] not in changed]
+            for id in reused:
+                site, previous = self.params['fabric'][id], self.previous_fabric[id]
+                if previous.ip_pools is not None:
+                    site.set_ip_pools(previous.ip_pools, keep=not counters_only)
+                else:
+                    site.ip_pool_count = previous.ip_pool_count
+                site.roles = previous.roles
+                site.show_commands = previous.show_commands
+            site_items = [item for item in site_items if item["id"] in changed]
+            self.params['fabric_delta'] = {
+                'snapshot': self.previous_name,
+                'reused_sites': reused,
+                'refreshed_sites': [item["id"] for item in site_items],
+            }
+            print(Fore.GREEN+"---Delta: {0} fabric site(s) unchanged, {1} to refresh".format(
+                len(reused), len(site_items))+Fore.RESET)
+
+        with ThreadPoolExecutor(max_workers=self.config['site_workers']) as executor:
+            site_details = executor.map(
+                lambda item: self.get_fabric_site_details(item["siteId"]), site_items)
+            for item, (ip_pools, site_roles) in zip(site_items, site_details):
+                site = self.params['fabric'][item["id"]]
+                site.set_ip_pools(ip_pools, keep=not counters_only)
+                site.roles = site_roles
 
     def fabric_summary(self):
-        for item in self.params['fabric']:
-            self.params['fabric'][item]["ip_pool_count"] = 0
-            self.params['fabric'][item]["edge_count"] = 0
-            self.params['fabric'][item]["control_count"] = 0
-            self.params['fabric'][item]["border_count"] = 0
-
-            if "ippool" in self.params['fabric'][item]:
-                self.params['fabric'][item]["ip_pool_count"] = len(
-                    self.params['fabric'][item]["ippool"])
-            if "edge" in self.params['fabric'][item]:
-                self.params['fabric'][item]["edge_count"] = len(
-                    self.params['fabric'][item]["edge"])
-            if "control" in self.params['fabric'][item]:
-                self.params['fabric'][item]["control_count"] = len(
-                    self.params['fabric'][item]["control"])
-            if "border" in self.params['fabric'][item]:
-                self.params['fabric'][item]["border_count"] = len(
-                    self.params['fabric'][item]["border"])
-
-    def get_fabric_inventory(self):
+        """Device and ip pool counts of every fabric site"""
+        summary = {}
+        for item, site in self.params['fabric'].items():
+            site = fabric_site(site)
+            summary[item] = {
+                'ip_pool_count': site.ip_pool_count,
+                'edge_count': site.roles.count('edge'),
+                'control_count': site.roles.count('control'),
+                'border_count': site.roles.count('border'),
+            }
+        return summary
+
+    def iter_fabric_inventory(self):
         """Retrieving fabric devices inventory"""
         print(Fore.GREEN+"---Retrieving fabric devices inventory list"+Fore.RESET)
-        r = self._get_url(
+        return self.iter_response_items(
             '/api/v2/data/customer-facing-service/DeviceInfo')
-        return r.json().get('response')
+
+    def get_fabric_inventory(self):
+        """Retrieving fabric devices inventory"""
+        return list(self.iter_fabric_inventory())
 
     @ask_for_permision('--Do you want to collect SDA fabric inventory')
     def fabric_inventory(self):
         """Filtering fabric devices inventory"""
         print(Fore.GREEN+"---Filtering fabric devices inventory list"+Fore.RESET)
-        self.params["global_fabric_devices"] = []
-        self.params["global_fabric_edge"] = []
-        self.params["global_fabric_control"] = []
-        self.params["global_fabric_border"] = []
-        #self.params["fabric_devices_details"] = []
-        fabric_devices_inventory = self.get_fabric_inventory()
-        for item in fabric_devices_inventory:
-            if "roles" in item:
-                if "EDGENODE" in item["roles"]:
-                    self.params["global_fabric_edge"].append(
-                        item["networkDeviceId"])
-                    self.params["global_fabric_devices"].append(
-                        item["networkDeviceId"])
-                    # self.params["fabric_devices_details"].append(item)
-                if "MAPSERVER" in item["roles"]:
-                    self.params["global_fabric_control"].append(
-                        item["networkDeviceId"])
-                    self.params["global_fabric_devices"].append(
-                        item["networkDeviceId"])
-                    # self.params["fabric_devices_details"].append(item)
-                if "BORDERNODE" in item["roles"]:
-                    self.params["global_fabric_border"].append(
-                        item["networkDeviceId"])
-                    self.params["global_fabric_devices"].append(
-                        item["networkDeviceId"])
-                    # self.params["fabric_devices_details"].append(item)
+        if self.previous and 'global_fabric' in self.previous and not self.changed_fabric_domains():
+            print(Fore.GREEN+"---Delta: fabric unchanged, reusing the previous inventory"+Fore.RESET)
+            self.params["global_fabric"] = FabricRoles.from_json(self.previous['global_fabric'])
+            return
+        fabric_index = self.get_fabric_index()
+        if fabric_index is not None:
+            self.params["global_fabric"] = fabric_index['global']
+        else:
+            self.params["global_fabric"] = FabricRoles()
+            for item in self.iter_fabric_inventory():
+                if "roles" in item:
+                    self.params["global_fabric"].add_item(item)
 
     def command_runner(self, device_uids, cmds):
         """Command Runner"""
@@ -435,91 +1369,454 @@ class DNACSession():
         """Checking Command Runner Task ID"""
         print(Fore.GREEN+"---Checking Command Runner Task ID"+Fore.RESET)
         r = self._get_url(
-            '/api/v1/task/{0}'.format(task_id))
+            '/api/v1/task/{0}'.format(task_id), cache=False)
         return r.json().get('response')
 
     def check_file(self, file_id):
         """Checking Command Runner File ID"""
         print(Fore.GREEN+"---Checking Command Runner File ID"+Fore.RESET)
-        r = self._get_url(
-            '/api/v1/file/{0}'.format(file_id))
-        return r.json()
-
-    def run_command(self, devices, cmds):
-        """Run Commands using command_runner"""
-        command = self.command_runner(devices, cmds)
-        task = self.check_task(command['taskId'])
-
-        retries = 12
-        while retries > 0:
-            try:
-                task_progress = json.loads(task["progress"])
-                file_id = task_progress["fileId"]
-                break
-            except Exception:
-                print(Fore.YELLOW+"---Task still running. Trying again..."+Fore.RESET)
-                task = self.check_task(command['taskId'])
-                time.sleep(2)
-                retries -= 1
-
-        if retries == 0:
-            print("Error checking task")
-            sys.exit(1)
-
-        retries = 6
-        while retries > 0:
+        return list(self.iter_response_items(
+            '/api/v1/file/{0}'.format(file_id), key=None, cache=False))
+
+    def _poll_delays(self):
+        """Yield exponentially growing poll delays with jitter"""
+        delay = self.config['poll_initial_delay']
+        while True:
+            yield delay / 2 + random.uniform(0, delay / 2)
+            delay = min(delay * self.config['poll_backoff'], self.config['poll_max_delay'])
+
+    def poll_tasks(self, task_ids, ready, timeout=None):
+        """Poll /api/v1/task for many tasks at once until ready(task) returns a value
+
+        Every poll cycle checks all outstanding tasks concurrently, then sleeps
+        with adaptive backoff. The whole wait is bounded by 'task_timeout'
+        seconds instead of a fixed number of retries. Returns the ready values
+        in task_ids order.
+        """
+        deadline = time.monotonic() + (timeout or self.config['task_timeout'])
+        delays = self._poll_delays()
+        results = {}
+        outstanding = list(dict.fromkeys(task_ids))
+
+        with ThreadPoolExecutor(max_workers=self.config['poll_workers']) as executor:
+            while True:
+                for task_id, task in zip(outstanding, list(executor.map(self.check_task, outstanding))):
+                    if task.get('isError'):
+                        print(Fore.RED+"Task {0} failed: {1}".format(
+                            task_id, task.get('failureReason', task.get('progress')))+Fore.RESET)
+                        sys.exit(1)
+                    value = ready(task)
+                    if value is not None:
+                        results[task_id] = value
+                outstanding = [task_id for task_id in outstanding if task_id not in results]
+                if not outstanding:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print("Error checking task, {0} task(s) still running".format(len(outstanding)))
+                    sys.exit(1)
+                print(Fore.YELLOW+"---{0} task(s) still running. Trying again...".format(
+                    len(outstanding))+Fore.RESET)
+                self._wait(min(next(delays), remaining))
+
+        return [results[task_id] for task_id in task_ids]
+
+    def retry_until_ready(self, function, error_message, timeout=None):
+        """Call function with adaptive backoff until it stops raising or times out"""
+        deadline = time.monotonic() + (timeout or self.config['file_timeout'])
+        delays = self._poll_delays()
+        while True:
             try:
-                file = self.check_file(file_id)
-                return file
+                return function()
             except Exception:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(error_message)
+                    sys.exit(1)
                 print(Fore.YELLOW+"---File not ready. Trying again..."+Fore.RESET)
-                time.sleep(2)
-                retries -= 1
+                self._wait(min(next(delays), remaining))
+
+    def _wait(self, delay):
+        """Sleep between polls, raise CancelledError once the job is stopped"""
+        if self.stop_event is None:
+            time.sleep(delay)
+        elif self.stop_event.wait(delay):
+            raise CancelledError('stopped')
+
+    @staticmethod
+    def _command_file_id(task):
+        """File id of a finished command runner task, None while it is running"""
+        try:
+            return json.loads(task["progress"])["fileId"]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def get_command_file(self, file_id):
+        """Retrieve a command runner file, retrying while it is not ready"""
+        return self.retry_until_ready(
+            lambda: self.check_file(file_id),
+            "Exception in Command Runner File Check")
+
+    def run_commands(self, jobs):
+        """Run command runner jobs split into device chunks submitted concurrently
+
+        jobs is a list of (devices, cmds) pairs. Every job's device list is split
+        into chunks of 'command_runner_batch_size' devices, all chunks are
+        submitted at once, their tasks are polled together and the returned
+        files are merged back into one file per job, in job order. With
+        'parse_show_commands' every file is parsed as soon as it is fetched.
+        """
+        if not jobs:
+            return []
+        batch_size = self.config['command_runner_batch_size']
+        chunks = []
+        for index, (devices, cmds) in enumerate(jobs):
+            for start in range(0, len(devices), batch_size):
+                chunks.append((index, devices[start:start + batch_size], cmds))
+
+        with ThreadPoolExecutor(max_workers=self.config['command_runner_workers']) as executor:
+            commands = list(executor.map(
+                lambda chunk: self.command_runner(chunk[1], chunk[2]), chunks))
+            file_ids = self.poll_tasks(
+                [command['taskId'] for command in commands], self._command_file_id)
+            files = list(executor.map(self._fetch_command_file, file_ids))
+
+        merged = [[] for job in jobs]
+        for (index, devices, cmds), file in zip(chunks, files):
+            if isinstance(file, list):
+                merged[index].extend(file)
+            else:
+                merged[index].append(file)
+        return merged
 
-        if retries == 0:
-            print("Exception in Command Runner File Check")
-            sys.exit(1)
+    def _fetch_command_file(self, file_id):
+        file = self.get_command_file(file_id)
+        if self.config['parse_show_commands']:
+            file = parse_command_file(file, self.config['keep_raw_output'])
+        return file
+
+    def run_command(self, devices, cmds):
+        """Run Commands using command_runner"""
+        return self.run_commands([(devices, cmds)])[0]
+
+    @staticmethod
+    def show_command_jobs(roles):
+        """Command runner jobs of a fabric site: VRFs and VLANs on edges, LISP on control nodes"""
+        jobs = []
+        if roles.count('edge'):
+            jobs.append((roles.with_role('edge'), ["show vrf", "show vlan"]))
+        if roles.count('control'):
+            jobs.append((roles.with_role('control'), ["show lisp site summary", "show lisp session"]))
+        return jobs
+
+    def prefetch_show_commands(self):
+        """Run the show commands of every fabric site, keyed by job
+
+        Runs as a background job on the DeviceInfo index and the
+        ConnectivityDomain list, both shared with the fabric stage, so the
+        commands are submitted before that stage has built the fabric sites.
+        """
+        index = self.get_fabric_index()
+        if index is None:
+            return {}
+        site_ids = set(
+            item["siteId"] for item in self.get_shared_fabric_domains() if "siteId" in item)
+        jobs = []
+        for site_id, roles in index['sites'].items():
+            if site_id in site_ids:
+                jobs.extend(self.show_command_jobs(roles))
+        return {
+            (tuple(devices), tuple(cmds)): file
+            for (devices, cmds), file in zip(jobs, self.run_commands(jobs))}
+
+    def start_background_jobs(self, stages):
+        """Start the server-side work of the given stages right away"""
+        if not self.config['background_jobs']:
+            return
+        for name, function in (
+                ('run_upgrade_report', self.collect_upgrade_report),
+                ('show_commands', self.prefetch_show_commands)):
+            if name == 'show_commands' and self.previous is not None:
+                # in delta mode only the changed sites run show commands
+                continue
+            if name in stages:
+                print(Fore.GREEN+"---Starting {0} in the background".format(name)+Fore.RESET)
+                self.jobs.start(name, self._background_job(name, function))
+
+    def _background_job(self, name, function):
+        view = copy.copy(self)
+        view.stop_event = self.jobs.stopped
+        function = getattr(view, function.__name__)
+
+        def job():
+            with view.tracer.stage('job ' + name):
+                return function()
+        return job
 
     @ask_for_permision('--Do you want to execute show commands?')
     def show_commands(self):
+        jobs = []
+        fabric_ids = []
+        reused = set(self.params.get('fabric_delta', {}).get('reused_sites', []))
         for id, item in self.params["fabric"].items():
-            self.params["fabric"][id]["show_commands"] = []
-            if item["edge"]:
-                cmds = ["show vrf", "show vlan"]
-                file = self.run_command(item["edge"], cmds)
-                self.params["fabric"][id]["show_commands"].append(file)
+            item = self.params["fabric"][id] = fabric_site(item)
+            if id in reused and item.show_commands is not None:
+                continue
+            item.show_commands = []
+            for job in self.show_command_jobs(item.roles):
+                jobs.append(job)
+                fabric_ids.append(id)
+
+        prefetched = self.jobs.result('show_commands', dict)
+        missing = [job for job in jobs if (tuple(job[0]), tuple(job[1])) not in prefetched]
+        prefetched.update(
+            ((tuple(devices), tuple(cmds)), file)
+            for (devices, cmds), file in zip(missing, self.run_commands(missing)))
+        files = [prefetched[(tuple(devices), tuple(cmds))] for devices, cmds in jobs]
+
+        for id, (devices, cmds), file in zip(fabric_ids, jobs, files):
+            if self.config['counters_only']:
+                file = self.summarize_command_file(cmds, file)
+            self.params["fabric"][id].show_commands.append(file)
+
+    @staticmethod
+    def summarize_command_file(cmds, file):
+        """Reduce a command runner file to the number of devices that answered and their parsed counts"""
+        succeeded = sum(
+            1 for device in file
+            if all(cmd in device.get('commandResponses', {}).get('SUCCESS', {}) for cmd in cmds))
+        summary = {
+            'commands': cmds,
+            'devices': len(file),
+            'succeeded': succeeded,
+        }
+        counts = total_counts(file)
+        if counts:
+            summary['counts'] = counts
+        return summary
+
+    def run_stages(self, stages=STAGES, journal=None, resume=False):
+        """Run collection stages on a bounded worker pool, respecting dependencies
+
+        Permission for every stage is asked up front. Each stage works on its
+        own view of the parameters (base values plus the results of the stages
+        it depends on) and the results are merged back in stage order, so the
+        final parameters match a sequential run.
+
+        With a journal every completed stage is recorded as soon as it
+        finishes; with resume the stages already in the journal are not run
+        again and their recorded results are merged instead.
+        """
+        completed = {}
+        if journal:
+            if resume:
+                completed = journal.load()
+            journal.start(append=bool(completed))
+
+        approved = {}
+        for name, depends in stages:
+            if name in completed:
+                print(Fore.GREEN+"---Stage {0} already completed, resuming".format(name)+Fore.RESET)
+                approved[name] = True
+            else:
+                approved[name] = self.confirm(getattr(self, name).permission_message)
+
+        depends_on = dict(stages)
+        base = dict(self.params)
+        results = {name: completed[name] for name in depends_on if name in completed}
+        pending = [name for name, depends in stages if approved[name] and name not in results]
+        running = {}
+        self.start_background_jobs([
+            name for name in pending
+            if all(approved.get(depend) for depend in depends_on[name])])
+
+        def ancestors(name):
+            found = set()
+            for depend in depends_on[name]:
+                found.add(depend)
+                found |= ancestors(depend)
+            return found
+
+        def stage_params(name):
+            params = dict(base)
+            required = ancestors(name)
+            for stage, depends in stages:
+                if stage in required:
+                    params.update(results[stage])
+            return params
+
+        failure = None
+        stopped = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.config['stage_workers'])
+        try:
+            while running or (pending and failure is None):
+                for name in list(pending) if failure is None else []:
+                    depends = depends_on[name]
+                    if any(depend not in approved or not approved[depend] for depend in depends):
+                        print(Fore.YELLOW+"---Skipping {0}, it requires {1}".format(
+                            name, ", ".join(depends))+Fore.RESET)
+                        approved[name] = False
+                        pending.remove(name)
+                    elif all(depend in results for depend in depends):
+                        future = executor.submit(
+                            self._run_stage, name, stage_params(name), stopped)
+                        running[future] = name
+                        pending.remove(name)
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except CancelledError:
+                        continue
+                    except BaseException as error:
+                        # let the running stages finish (and be journaled) first
+                        failure = failure or error
+                        continue
+                    if journal:
+                        journal.record(name, results[name])
+                if failure:
+                    # stages still queued behind the workers are not started
+                    for future in list(running):
+                        if future.cancel():
+                            running.pop(future)
+            if failure:
+                raise failure
+        finally:
+            for future in list(running):
+                if future.cancel():
+                    running.pop(future)
+            executor.shutdown(wait=not running)
+            self.jobs.shutdown()
+
+        self.params = base
+        for name, depends in stages:
+            if name in results:
+                self.params.update(results[name])
+        return self.params
 
-            if item["control"]:
-                cmds = ["show lisp site summary", "show lisp session"]
-                file = self.run_command(item["control"], cmds)
-                self.params["fabric"][id]["show_commands"].append(file)
+    def _run_stage(self, name, params, stopped=None):
+        """Run a single stage on a session view and return the parameters it added
 
-    def _get_hosts_via_sitehealth(self):
+        Once any stage has failed (stopped is set) a stage that a worker
+        picks up afterwards is not started.
+        """
+        if stopped is not None and stopped.is_set():
+            raise CancelledError(name)
+        view = copy.copy(self)
+        view.params = params
+        try:
+            with self.tracer.stage(name):
+                getattr(type(self), name).__wrapped__(view)
+        except BaseException:
+            if stopped is not None:
+                stopped.set()
+            raise
+        return {key: value for key, value in view.params.items() if key not in self.params}
+
+    def _post_sitehealth(self, start_time, end_time):
         payload = {
             "typeList": {
                 "type": "SITE",
-                "startTime": self.epoch_time - 300000,  # 5 mins
-                "endTime": self.epoch_time,
-                "timeAPITime": self.epoch_time
+                "startTime": start_time,
+                "endTime": end_time,
+                "timeAPITime": end_time
             },
             "option": "CLIENT",
             "selectedTypeIdList": [
                 "__global__"
             ]
         }
-        r = self._post_url(
-            '/api/assurance/v1/host/dash/healthdetail', payload=payload)
+        return self._post_url(HEALTH_URL, payload=payload)
+
+    def _get_hosts_via_sitehealth(self):
+        r = self._post_sitehealth(self.epoch_time - 300000, self.epoch_time)  # 5 mins
         return r.json().get('response')
 
+    @staticmethod
+    def _sitehealth_client_counts(sites):
+        """Wired and wireless unique client counts of a healthdetail response"""
+        counts = {}
+        for site in sites or []:
+            for item in site['scoreDetail']:
+                if item['scoreCategory']['value'] in ('WIRED', 'WIRELESS'):
+                    counts[item['scoreCategory']['value']] = item['clientUniqueCount']
+        return counts
+
+    def get_sitehealth_window(self, start_time, end_time):
+        """Client counts of one completed window, None when it could not be read
+
+        Windows that ended more than 'health_settle' seconds ago no longer
+        change, so they are kept in the health cache and a later run only
+        asks for the windows it has not seen yet. Recent windows, which
+        assurance may still be filling in, and empty counts are not cached.
+        """
+        key = '{0}#{1}-{2}'.format(self._create_url(HEALTH_URL), start_time, end_time)
+        if self.health_cache is not None and not self.config['cache_bypass']:
+            r = self.health_cache.get(key)
+            if r is not None:
+                return self._sitehealth_client_counts(r.json().get('response'))
+        r = self._post_sitehealth(start_time, end_time)
+        if r.status_code != 200:
+            print(Fore.YELLOW+"---Health window {0} not available ({1})".format(
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(end_time / 1000)),
+                r.status_code)+Fore.RESET)
+            return None
+        counts = self._sitehealth_client_counts(r.json().get('response'))
+        settled = end_time <= self.epoch_time - self.config['health_settle'] * 1000
+        if self.health_cache is not None and settled and counts:
+            self.health_cache.put(key, r)
+        return counts
+
+    def sitehealth_windows(self):
+        """Windows sampled over the lookback, newest first, as (start, end) epoch ms
+
+        The lookback is split into 'health_samples' equal slots and the
+        window ending each slot is sampled. Windows are aligned to their
+        length so consecutive runs ask for the same, cacheable windows.
+        """
+        window = self.config['health_window'] * 1000
+        lookback = self.config['health_lookback'] * 1000
+        samples = max(min(self.config['health_samples'], lookback // window), 1)
+        slot = lookback // samples
+        end_time = self.epoch_time // window * window
+        return [(end_time - index * slot - window, end_time - index * slot)
+                for index in range(samples)]
+
+    def _sample_hosts_via_sitehealth(self):
+        windows = self.sitehealth_windows()
+        print(Fore.GREEN+"---Sampling {0} healthcheck windows".format(len(windows))+Fore.RESET)
+        with ThreadPoolExecutor(max_workers=self.config['health_workers']) as executor:
+            samples = [counts for counts in executor.map(
+                lambda window: self.get_sitehealth_window(*window), windows)
+                if counts is not None]
+        if not samples:
+            print(Fore.RED+"---No healthcheck window could be read"+Fore.RESET)
+            return
+
+        sampling = {
+            'lookback': self.config['health_lookback'],
+            'window': self.config['health_window'],
+            'windows': len(samples),
+        }
+        for category, param in (('WIRED', 'wired'), ('WIRELESS', 'wireless')):
+            sampling[param] = summarize_samples([counts.get(category, 0) for counts in samples])
+            self.params[param + '_hosts_count_via_healthcheck'] = sampling[param]['peak']
+        self.params['hosts_via_healthcheck_sampling'] = sampling
+
     def _count_hosts_via_sitehealt(self):
         print(Fore.GREEN+"---Counting system hosts via healtcheck"+Fore.RESET)
-        sites = self._get_hosts_via_sitehealth()
-        for site in sites:
-            for item in site['scoreDetail']:
-                if item['scoreCategory']['value'] == 'WIRELESS':
-                    self.params['wireless_hosts_count_via_healthcheck'] = item['clientUniqueCount']
-                if item['scoreCategory']['value'] == 'WIRED':
-                    self.params['wired_hosts_count_via_healthcheck'] = item['clientUniqueCount']
+        if self.config['health_lookback']:
+            return self._sample_hosts_via_sitehealth()
+        counts = self._sitehealth_client_counts(self._get_hosts_via_sitehealth())
+        if 'WIRELESS' in counts:
+            self.params['wireless_hosts_count_via_healthcheck'] = counts['WIRELESS']
+        if 'WIRED' in counts:
+            self.params['wired_hosts_count_via_healthcheck'] = counts['WIRED']
 
     def get_images(self):
         """Retreive a list of software images"""
@@ -532,8 +1829,9 @@ class DNACSession():
     def count_images(self):
         """Counting golden software images"""
         print(Fore.GREEN+"---Counting golden software images"+Fore.RESET)
-        images = self.get_images()
-        golden_images = [image for image in images if image['isTaggedGolden'] == True]
+        golden_images = self.get_filtered(
+            '/api/v1/image/importation', {'isTaggedGolden': 'true'},
+            lambda image: image['isTaggedGolden'] == True)
         self.params['golden_images_count'] = len(golden_images)
 
     def upgrade_report(self):
@@ -545,55 +1843,75 @@ class DNACSession():
         return r.json().get('response')
 
     def download_file(self, file_url):
-        """Downloading File URL"""
+        """Stream a file to disk, resuming a partial download with a Range request
+
+        Data is written to a '.part' file as it arrives while its SHA-256 is
+        computed. When a previous attempt left a partial file only the missing
+        bytes are requested. Returns the file name and its SHA-256.
+        """
         print(Fore.GREEN+"---Downloading File URL"+Fore.RESET)
-        r = self._get_url(file_url)
+        dir_path = self.config['output_dir']
+        part_path = os.path.join(dir_path, '.download-{0}.part'.format(
+            hashlib.sha256(self._create_url(file_url).encode()).hexdigest()[:16]))
+
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {'Range': 'bytes={0}-'.format(offset)} if offset else None
+        r = self._get_url(file_url, stream=True, cache=False,
+                          headers=headers, exit_on_error=False)
+        if r.status_code == 416:
+            # the partial file does not match the file on the appliance
+            r.close()
+            os.remove(part_path)
+            return self.download_file(file_url)
+        elif r.status_code not in (200, 206):
+            print("Error bad response", r.status_code, r.text)
+            sys.exit(1)
 
-        file_name = r.headers['fileName']
-        dir_path = os.path.dirname(os.path.abspath(sys.argv[0]))
-        file_path = os.path.join(dir_path, file_name)
+        sha256 = hashlib.sha256()
+        if r.status_code == 206:
+            print(Fore.GREEN+"---Resuming download at {0} bytes".format(offset)+Fore.RESET)
+            with open(part_path, 'rb') as part_file:
+                for chunk in iter(lambda: part_file.read(self.config['stream_chunk_size']), b''):
+                    sha256.update(chunk)
+        else:
+            offset = 0
 
-        with open(file_path, 'wb') as report_file:
-            report_file.write(r.content)
+        expected = r.headers.get('Content-Length')
+        received = 0
+        try:
+            with open(part_path, 'ab' if offset else 'wb') as part_file:
+                for chunk in r.iter_content(chunk_size=self.config['stream_chunk_size']):
+                    part_file.write(chunk)
+                    sha256.update(chunk)
+                    received += len(chunk)
+        finally:
+            r.close()
+        if expected is not None and received < int(expected):
+            raise IOError("Download interrupted after {0} of {1} bytes".format(
+                received, expected))
+
+        file_name = self.config['download_prefix'] + r.headers['fileName']
+        os.replace(part_path, os.path.join(dir_path, file_name))
         print(Fore.GREEN+"---Downloaded File {0}".format(file_name)+Fore.RESET)
 
-        return file_name
+        return file_name, sha256.hexdigest()
+
+    def collect_upgrade_report(self):
+        """Generate the upgrade readiness report and download it, returns file and SHA-256"""
+        report = self.upgrade_report()
+        file_url = self.poll_tasks(
+            [report['taskId']], lambda task: task.get("additionalStatusURL"))[0]
+        return self.retry_until_ready(
+            lambda: self.download_file(file_url),
+            "Exception in Downloading File")
 
     @ask_for_permision('--Do you want to generate upgrade readiness report?')
     def run_upgrade_report(self):
         """Run report"""
-        report = self.upgrade_report()
-        task = self.check_task(report['taskId'])
-
-        retries = 12
-        while retries > 0:
-            try:
-                file_id = task["additionalStatusURL"]
-                break
-            except Exception:
-                print(Fore.YELLOW+"---Task still running. Trying again..."+Fore.RESET)
-                task = self.check_task(report['taskId'])
-                time.sleep(2)
-                retries -= 1
-
-        if retries == 0:
-            print("Error checking task")
-            sys.exit(1)
-
-        retries = 6
-        while retries > 0:
-            try:
-                file = self.download_file(file_id)
-                self.params['upgrade_readiness_report'] = file
-                return file
-            except Exception:
-                print(Fore.YELLOW+"---File not ready. Trying again..."+Fore.RESET)
-                time.sleep(2)
-                retries -= 1
-
-        if retries == 0:
-            print("Exception in Downloading File")
-            sys.exit(1)
+        file, sha256 = self.jobs.result('run_upgrade_report', self.collect_upgrade_report)
+        self.params['upgrade_readiness_report'] = file
+        self.params['upgrade_readiness_report_sha256'] = sha256
+        return file
 
     def get_image_update_status(self):
         """Retreive a list of image update status"""
@@ -606,6 +1924,7 @@ class DNACSession():
     def count_image_update_status(self):
         """Counting image upgrades"""
         print(Fore.GREEN+"---Counting image upgrades"+Fore.RESET)
-        image_upgrades = self.get_image_update_status()
-        upgrades = [image_upgrade for image_upgrade in image_upgrades if image_upgrade['taskStatus'] == "success"]
+        upgrades = self.get_filtered(
+            '/api/v1/image/task?taskType=activate', {'taskStatus': 'success'},
+            lambda image_upgrade: image_upgrade['taskStatus'] == "success")
         self.params['upgrade_images_count'] = len(upgrades)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Streaming Export.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import gzip
+import io
+import json
+import os
+import zlib
+from dnacmodel import json_default
+
+try:
+    import pyAesCrypt
+except ImportError:
+    pyAesCrypt = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+BUFFER_SIZE = 64 * 1024
+
+EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+def iter_json_chunks(params):
+    """Serialize params one top-level entry (stage result) at a time
+
+    The output is byte for byte what json.dump(params) writes, produced as
+    small string chunks so it never exists as a whole in memory.
+    """
+    encoder = json.JSONEncoder(default=json_default)
+    yield '{'
+    for index, (key, value) in enumerate(params.items()):
+        if index:
+            yield ', '
+        yield encoder.encode(key) + ': '
+        for chunk in encoder.iterencode(value):
+            yield chunk
+    yield '}'
+
+def _to_blocks(chunks, buffer_size):
+    """Group string chunks into UTF-8 blocks of about buffer_size bytes"""
+    block = []
+    block_size = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        block.append(data)
+        block_size += len(data)
+        if block_size >= buffer_size:
+            yield b''.join(block)
+            block = []
+            block_size = 0
+    if block:
+        yield b''.join(block)
+
+def _compress(blocks, compressor):
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def _compressor(compression):
+    if compression == 'gzip':
+        return zlib.compressobj(9, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd compression requires the 'zstandard' package")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("Unknown compression '{0}'".format(compression))
+
+
+class _BlockReader():
+    """Read-only file object over an iterator of byte blocks"""
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.buffer = b''
+
+    def read(self, size):
+        parts = [self.buffer]
+        available = len(self.buffer)
+        while available < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            parts.append(block)
+            available += len(block)
+        data = b''.join(parts)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def write_json_stream(file_path, params, compression=None, password=None,
+                      buffer_size=BUFFER_SIZE):
+    """Stream params to file_path, compressing and AES encrypting on the fly
+
+    The extension of the chosen compression ('.gz' or '.zst') and '.aes' when a
+    password is given are appended to file_path. The data is written to a
+    temporary file first, so a failed export never leaves a truncated file
+    behind. Returns the path of the written file.
+    """
+    if password and pyAesCrypt is None:
+        raise ValueError("Encryption requires the 'pyAesCrypt' package")
+
+    blocks = _to_blocks(iter_json_chunks(params), buffer_size)
+    if compression:
+        blocks = _compress(blocks, _compressor(compression))
+    file_path += EXTENSIONS[compression]
+    if password:
+        file_path += '.aes'
+
+    temp_path = file_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as export_file:
+            if password:
+                pyAesCrypt.encryptStream(
+                    _BlockReader(blocks), export_file, password, buffer_size)
+            else:
+                for block in blocks:
+                    export_file.write(block)
+        os.replace(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return file_path
+
+def read_json_stream(file_path):
+    """Load a file written by write_json_stream without a password
+
+    The compression is taken from the extension, encrypted files raise
+    ValueError since they need the password.
+    """
+    if file_path.endswith('.aes'):
+        raise ValueError("{0} is encrypted".format(os.path.basename(file_path)))
+    if file_path.endswith(EXTENSIONS['gzip']):
+        with gzip.open(file_path, 'rt', encoding='utf-8') as json_file:
+            return json.load(json_file)
+    if file_path.endswith(EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise ValueError("{0} needs the 'zstandard' package".format(os.path.basename(file_path)))
+        with open(file_path, 'rb') as raw_file:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw_file)
+            return json.load(io.TextIOWrapper(reader, encoding='utf-8'))
+    with open(file_path, 'r') as json_file:
+        return json.load(json_file)
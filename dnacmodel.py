@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Fabric Data Model.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import sys
+
+ROLE_EDGE = 1
+ROLE_CONTROL = 2
+ROLE_BORDER = 4
+
+# DeviceInfo fabric roles, the name they are reported under and their bit
+FABRIC_ROLES = (
+    ('EDGENODE', 'edge', ROLE_EDGE),
+    ('MAPSERVER', 'control', ROLE_CONTROL),
+    ('BORDERNODE', 'border', ROLE_BORDER),
+)
+
+
+class FabricRoles():
+    """Fabric devices with their roles as a bitmask
+
+    Every device is stored once, under its interned networkDeviceId, no
+    matter how many roles it has. Per role counts are kept up to date as
+    devices are added, so all counts are O(1).
+    """
+    __slots__ = ('devices', 'counts')
+
+    def __init__(self):
+        self.devices = {}
+        self.counts = {name: 0 for role, name, bit in FABRIC_ROLES}
+
+    def add(self, device_id, mask):
+        device_id = sys.intern(device_id)
+        known = self.devices.get(device_id, 0)
+        for role, name, bit in FABRIC_ROLES:
+            if mask & bit and not known & bit:
+                self.counts[name] += 1
+        self.devices[device_id] = known | mask
+
+    def add_item(self, item):
+        """Add a DeviceInfo item, ignoring items without fabric roles"""
+        mask = 0
+        for role, name, bit in FABRIC_ROLES:
+            if role in item["roles"]:
+                mask |= bit
+        if mask:
+            self.add(item["networkDeviceId"], mask)
+
+    def with_role(self, name):
+        """Device ids having the named role, in discovery order"""
+        bit = dict((role_name, role_bit) for role, role_name, role_bit in FABRIC_ROLES)[name]
+        return [device_id for device_id, mask in self.devices.items() if mask & bit]
+
+    def count(self, name):
+        if name == 'devices':
+            return len(self.devices)
+        return self.counts[name]
+
+    def to_json(self):
+        result = {'devices': list(self.devices)}
+        for role, name, bit in FABRIC_ROLES:
+            result[name] = self.with_role(name)
+        return result
+
+    @classmethod
+    def from_json(cls, data):
+        masks = {}
+        for role, name, bit in FABRIC_ROLES:
+            for device_id in data.get(name, []):
+                masks[device_id] = masks.get(device_id, 0) | bit
+        roles = cls()
+        for device_id in list(data.get('devices', [])) + list(masks):
+            if device_id in masks:
+                roles.add(device_id, masks.pop(device_id))
+        return roles
+
+
+class FabricSite():
+    """Collected data of a single fabric domain (site, LAN or transit)"""
+    __slots__ = ('name', 'vn_count', 'domain_type', 'details', 'ip_pools',
+                 'ip_pool_count', 'roles', 'show_commands')
+
+    def __init__(self, name, vn_count, domain_type, details=None):
+        self.name = name
+        self.vn_count = vn_count
+        self.domain_type = domain_type
+        self.details = details
+        self.ip_pools = None
+        self.ip_pool_count = 0
+        self.roles = FabricRoles()
+        self.show_commands = None
+
+    def set_ip_pools(self, ip_pools, keep=True):
+        self.ip_pool_count = len(ip_pools)
+        self.ip_pools = ip_pools if keep else None
+
+    def to_json(self):
+        result = {
+            'vn_count': self.vn_count,
+            'name': self.name,
+            'domain_type': self.domain_type,
+        }
+        if self.details is not None:
+            result['fabric_details'] = self.details
+        if self.ip_pools is not None:
+            result['ippool'] = self.ip_pools
+        result['ip_pool_count'] = self.ip_pool_count
+        result.update(self.roles.to_json())
+        for name in ('devices', 'edge', 'control', 'border'):
+            result[name + '_count'] = self.roles.count(name)
+        if self.show_commands is not None:
+            result['show_commands'] = self.show_commands
+        return result
+
+    @classmethod
+    def from_json(cls, data):
+        """Rebuild a site from its JSON form, including files written before the model"""
+        details = data.get('fabric_details')
+        domain_type = data['domain_type'] if 'domain_type' in data else details['domainType']
+        site = cls(data['name'], data['vn_count'], domain_type, details)
+        if 'ippool' in data:
+            site.set_ip_pools(data['ippool'])
+        else:
+            site.ip_pool_count = data.get('ip_pool_count', 0)
+        site.roles = FabricRoles.from_json(data)
+        site.show_commands = data.get('show_commands')
+        return site
+
+
+def index_fabric_devices(fabric_devices_inventory):
+    """Index the global DeviceInfo list by site and by role in a single pass
+
+    Returns None when an item does not tell its site, so callers can fall
+    back to per-site queries.
+    """
+    index = {'global': FabricRoles(), 'sites': {}}
+    for item in fabric_devices_inventory:
+        if "roles" not in item:
+            continue
+        if "siteDeviceList" not in item:
+            return None
+        index['global'].add_item(item)
+        site_ids = item["siteDeviceList"]
+        if not isinstance(site_ids, list):
+            site_ids = [site_ids]
+        for site_id in site_ids:
+            if site_id not in index['sites']:
+                index['sites'][site_id] = FabricRoles()
+            index['sites'][site_id].add_item(item)
+    return index
+
+def domain_markers(item):
+    """Change markers of a ConnectivityDomain item: last update, version and VN count"""
+    return (item.get('lastUpdateTime'), item.get('instanceVersion'),
+            len(item.get('virtualNetwork') or []))
+
+def unchanged_domain(site, item):
+    """True when a previously collected site still matches its ConnectivityDomain item
+
+    Sites without stored details or items without markers count as changed.
+    """
+    if site is None or site.details is None:
+        return False
+    markers = domain_markers(item)
+    return markers[:2] != (None, None) and domain_markers(site.details) == markers
+
+def fabric_site(data):
+    """FabricSite of a params['fabric'] entry, which may come from a JSON file"""
+    return data if isinstance(data, FabricSite) else FabricSite.from_json(data)
+
+def json_default(obj):
+    """json default hook serializing the fabric model objects"""
+    if isinstance(obj, (FabricRoles, FabricSite)):
+        return obj.to_json()
+    raise TypeError("Object of type {0} is not JSON serializable".format(
+        type(obj).__name__))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Show Command Parsers.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import re
+
+# "  VN_1    <not set>    ipv4    LI0.4097", continuation lines only list interfaces
+VRF_ROW = re.compile(r'^  (?! )(\S+)\s+(<not set>|\S+:\S+)\s+(\S+)', re.MULTILINE)
+# "1021 VLAN1021    active    Gi1/0/1", the VLAN type table that follows has no status
+VLAN_ROW = re.compile(
+    r'^(\d{1,4})\s+(\S+)\s+(active|suspended|act/lshut|sus/lshut|act/ishut|sus/ishut|act/unsup)\b',
+    re.MULTILINE)
+LISP_SITES_CONFIGURED = re.compile(r'Number of configured sites:\s+(\d+)')
+LISP_SITE_ROW = re.compile(r'^(\S+)\s+\d+\s+\d+\s+\d+\s+\d+\s+\d+\s+\d+\s*$', re.MULTILINE)
+# "10.0.0.1:4342    Up    1w2d    20/18    4"
+LISP_SESSION_ROW = re.compile(r'^(\S+)\s+(Up|Down|Init|Incomplete)\s+\S+', re.MULTILINE | re.IGNORECASE)
+
+
+def parse_show_vrf(output):
+    return {'vrfs': len(VRF_ROW.findall(output))}
+
+def parse_show_vlan(output):
+    return {'vlans': len(VLAN_ROW.findall(output))}
+
+def parse_show_lisp_site_summary(output):
+    configured = LISP_SITES_CONFIGURED.search(output)
+    if configured:
+        return {'lisp_sites': int(configured.group(1))}
+    return {'lisp_sites': len(LISP_SITE_ROW.findall(output))}
+
+def parse_show_lisp_session(output):
+    up = down = 0
+    for peer, state in LISP_SESSION_ROW.findall(output):
+        if state.lower() == 'up':
+            up += 1
+        else:
+            down += 1
+    return {'lisp_sessions_up': up, 'lisp_sessions_down': down}
+
+COMMAND_PARSERS = {
+    'show vrf': parse_show_vrf,
+    'show vlan': parse_show_vlan,
+    'show lisp site summary': parse_show_lisp_site_summary,
+    'show lisp session': parse_show_lisp_session,
+}
+
+
+def parse_device_outputs(outputs):
+    """Counts of the successful outputs of one device, commands without a parser are skipped"""
+    counts = {}
+    for cmd, output in outputs.items():
+        parser = COMMAND_PARSERS.get(cmd)
+        if parser and isinstance(output, str):
+            counts.update(parser(output))
+    return counts
+
+def parse_command_file(file, keep_raw=True):
+    """Add the parsed counts to every device of a command runner file
+
+    Each device gets a 'parsed' dict. Without keep_raw the successful
+    outputs are replaced by None once parsed, the command names are kept.
+    """
+    if not isinstance(file, list):
+        return file
+    for device in file:
+        outputs = device.get('commandResponses', {}).get('SUCCESS')
+        if not outputs:
+            continue
+        device['parsed'] = parse_device_outputs(outputs)
+        if not keep_raw:
+            for cmd in outputs:
+                if cmd in COMMAND_PARSERS:
+                    outputs[cmd] = None
+    return file
+
+def total_counts(file):
+    """Parsed counts of a command runner file summed over its devices"""
+    totals = collections.Counter()
+    for device in file:
+        totals.update(device.get('parsed', {}))
+    return dict(totals)
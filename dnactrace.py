@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Request and Stage Tracing.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import collections
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlparse
+
+# Path segments that carry an identifier, grouped into one endpoint
+ENDPOINT_IDS = re.compile(r'/(task|file)/[^/]+')
+
+
+def endpoint(url):
+    """Group a request url by its API path, without host, query and ids"""
+    return ENDPOINT_IDS.sub(r'/\1/{id}', urlparse(url).path)
+
+
+class RequestTrace():
+    """One HTTP request, filled in by DNACSession while it is sent"""
+    __slots__ = ('method', 'url', 'start', 'duration', 'status',
+                 'bytes_sent', 'bytes_received', 'retries', 'cached', 'thread')
+
+    def __init__(self, method, url, start):
+        self.method = method
+        self.url = url
+        self.start = start
+        self.duration = 0.0
+        self.status = None
+        self.bytes_sent = 0
+        self.bytes_received = None
+        self.retries = 0
+        self.cached = False
+        self.thread = threading.get_ident()
+
+    def set_response(self, r, stream=False, cached=False):
+        self.status = r.status_code
+        self.cached = cached
+        length = r.headers.get('Content-Length')
+        if length is not None:
+            self.bytes_received = int(length)
+        elif not stream:
+            self.bytes_received = len(r.content or b'')
+
+    def to_json(self):
+        return {
+            'method': self.method,
+            'url': self.url,
+            'endpoint': endpoint(self.url),
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'retries': self.retries,
+            'cached': self.cached,
+        }
+
+
+class StageTrace():
+    """Wall time and peak traced memory of one collection stage"""
+    __slots__ = ('name', 'start', 'duration', 'peak_bytes', 'thread')
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.peak_bytes = None
+        self.thread = threading.get_ident()
+
+    def to_json(self):
+        return {
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'peak_bytes': self.peak_bytes,
+        }
+
+
+class Tracer():
+    """Record every request and stage of a run
+
+    Times are seconds since the tracer was created. Stages can run at the
+    same time, so with memory tracing a sampler thread keeps for every
+    running stage the highest traced memory of the process seen while it
+    ran. A disabled tracer records nothing.
+    """
+    def __init__(self, enabled=False, memory=True, sample_interval=0.01):
+        self.enabled = enabled
+        self.memory = enabled and memory
+        self.sample_interval = sample_interval
+        self.started = time.perf_counter()
+        self.started_epoch = time.time()
+        self.requests = []
+        self.stages = []
+        self.running = set()
+        self.current = threading.local()
+        self.lock = threading.Lock()
+        self.sampler = None
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def now(self):
+        return time.perf_counter() - self.started
+
+    @contextlib.contextmanager
+    def request(self, method, url):
+        """Time a request, the caller stores the response with set_response"""
+        if not self.enabled:
+            yield None
+            return
+        call = RequestTrace(method, url, self.now())
+        self.current.request = call
+        try:
+            yield call
+        finally:
+            call.duration = self.now() - call.start
+            self.current.request = None
+            with self.lock:
+                self.requests.append(call)
+
+    def retry(self):
+        """Count a retry of the request sent by this thread"""
+        call = getattr(self.current, 'request', None)
+        if call is not None:
+            call.retries += 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield None
+            return
+        stage = StageTrace(name, self.now())
+        if self.memory:
+            stage.peak_bytes = tracemalloc.get_traced_memory()[0]
+            with self.lock:
+                self.running.add(stage)
+                if self.sampler is None:
+                    self.sampler = threading.Thread(target=self._sample, daemon=True)
+                    self.sampler.start()
+        try:
+            yield stage
+        finally:
+            stage.duration = self.now() - stage.start
+            with self.lock:
+                if self.memory:
+                    self._update_peaks()
+                    self.running.discard(stage)
+                self.stages.append(stage)
+
+    def _sample(self):
+        while True:
+            time.sleep(self.sample_interval)
+            with self.lock:
+                if not self.running:
+                    self.sampler = None
+                    return
+                self._update_peaks()
+
+    def _update_peaks(self):
+        current = tracemalloc.get_traced_memory()[0]
+        for stage in self.running:
+            if current > stage.peak_bytes:
+                stage.peak_bytes = current
+
+    def to_json(self):
+        with self.lock:
+            return {
+                'started': self.started_epoch,
+                'requests': [call.to_json() for call in self.requests],
+                'stages': [stage.to_json() for stage in self.stages],
+            }
+
+    def to_chrome_trace(self):
+        """Trace Event Format, open it in chrome://tracing or Perfetto"""
+        events = []
+        with self.lock:
+            for stage in self.stages:
+                events.append({
+                    'name': stage.name, 'cat': 'stage', 'ph': 'X', 'pid': os.getpid(),
+                    'tid': stage.thread, 'ts': stage.start * 1e6, 'dur': stage.duration * 1e6,
+                    'args': {'peak_bytes': stage.peak_bytes},
+                })
+            for call in self.requests:
+                events.append({
+                    'name': '{0} {1}'.format(call.method, endpoint(call.url)), 'cat': 'request',
+                    'ph': 'X', 'pid': os.getpid(), 'tid': call.thread,
+                    'ts': call.start * 1e6, 'dur': call.duration * 1e6,
+                    'args': {'url': call.url, 'status': call.status, 'retries': call.retries,
+                             'bytes_received': call.bytes_received, 'cached': call.cached},
+                })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, file_path):
+        """Write the JSON trace and the Chrome trace next to it, return both paths"""
+        chrome_path = os.path.splitext(file_path)[0] + '.chrome.json'
+        for path, data in ((file_path, self.to_json()), (chrome_path, self.to_chrome_trace())):
+            with open(path, 'w') as trace_file:
+                json.dump(data, trace_file)
+        return file_path, chrome_path
+
+    def summary(self):
+        """Per endpoint and per stage summary table, slowest first"""
+        endpoints = collections.OrderedDict()
+        with self.lock:
+            for call in self.requests:
+                key = '{0} {1}'.format(call.method, endpoint(call.url))
+                total = endpoints.setdefault(key, collections.Counter())
+                total['count'] += 1
+                total['seconds'] += call.duration
+                total['max'] = max(total['max'], call.duration)
+                total['bytes'] += call.bytes_received or 0
+                total['retries'] += call.retries
+                total['cached'] += call.cached
+                total['errors'] += call.status is None or call.status >= 400
+            stages = list(self.stages)
+
+        lines = ["{0:<58} {1:>6} {2:>9} {3:>9} {4:>9} {5:>11} {6:>7} {7:>6}".format(
+            'endpoint', 'calls', 'total s', 'mean ms', 'max ms', 'bytes', 'retries', 'errors')]
+        for key, total in sorted(endpoints.items(), key=lambda item: -item[1]['seconds']):
+            lines.append("{0:<58} {1:>6} {2:>9.3f} {3:>9.1f} {4:>9.1f} {5:>11} {6:>7} {7:>6}".format(
+                key[:58], total['count'], total['seconds'],
+                total['seconds'] / total['count'] * 1000, total['max'] * 1000,
+                total['bytes'], total['retries'], total['errors']))
+        lines.append('')
+        lines.append("{0:<58} {1:>9} {2:>12}".format('stage', 'wall s', 'peak MiB'))
+        for stage in sorted(stages, key=lambda stage: -stage.duration):
+            lines.append("{0:<58} {1:>9.3f} {2:>12}".format(
+                stage.name, stage.duration,
+                '-' if stage.peak_bytes is None else '{0:.1f}'.format(stage.peak_bytes / (1024 * 1024))))
+        return '\n'.join(lines)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Fleet Console Script.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+from dnacbackend import DNACSession, StageJournal
+from main import read_json_file, write_json_file, exctract_validation_data, host_tag, journal_path
+from main import check_optional_packages
+from colorama import init, deinit, Fore, Back, Style
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import re
+import sys
+import time
+
+FLEET_FILE_EXAMPLE = """
+{
+    "defaults": {"username": "admin", "executer_name": "Jane Doe", "executer_cco": "jdoe"},
+    "clusters": [
+        {"host": "dnac1.example.com", "password": "..."},
+        {"host": "dnac2.example.com", "port": 8443, "username": "other", "password": "..."}
+    ]
+}
+"""
+
+ANSI_CODE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+class LastLine():
+    """Write through to stream and remember the last line printed
+
+    A cluster run ends with sys.exit(1) after printing why, usually in
+    red, so the last red line (or else the last line) is that reason.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = ''
+        self.line = ''
+        self.error = ''
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        for line in lines:
+            plain = ANSI_CODE.sub('', line).strip()
+            if plain:
+                self.line = plain
+                if Fore.RED in line:
+                    self.error = plain
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def reason(self):
+        return self.error or self.line
+
+
+def read_fleet_file(file_url):
+    """Clusters of the fleet file, each one merged with the file defaults
+
+    Workers cannot ask for anything, so every cluster needs a host and
+    either a token or a username and password. Journal and output files
+    are named after the host, so a host may be listed only once.
+    """
+    fleet = read_json_file(file_url)
+    defaults = fleet.get('defaults', {})
+    clusters = []
+    hosts = set()
+    for index, cluster in enumerate(fleet['clusters']):
+        settings = dict(defaults)
+        settings.update(cluster)
+        if not settings.get('host'):
+            print(Fore.RED+"Cluster {0} of {1} has no host".format(index + 1, file_url)+Fore.RESET)
+            sys.exit(1)
+        if not settings.get('token') and not (settings.get('username') and settings.get('password')):
+            print(Fore.RED+"Cluster {0} needs a token or a username and password".format(
+                settings['host'])+Fore.RESET)
+            sys.exit(1)
+        if settings['host'] in hosts:
+            print(Fore.RED+"Cluster {0} is listed more than once".format(settings['host'])+Fore.RESET)
+            sys.exit(1)
+        hosts.add(settings['host'])
+        clusters.append(settings)
+    return clusters
+
+def collect_cluster(cluster, stamp, resume=False, compression=None):
+    """Headless activation check of a single cluster, run in a worker process"""
+    host = cluster['host']
+    config = {'ask_for_permission': False, 'download_prefix': host_tag(host) + '-'}
+    config.update(cluster.get('config', {}))
+    output, sys.stdout = sys.stdout, LastLine(sys.stdout)
+    try:
+        connection = DNACSession(
+            host=host,
+            port=cluster.get('port', 80),
+            username=cluster.get('username'),
+            password=cluster.get('password'),
+            token=cluster.get('token'),
+            config=config,
+            executer_name=cluster.get('executer_name', ''),
+            executer_cco=cluster.get('executer_cco', ''))
+        journal = StageJournal(journal_path(host), host)
+        connection.run_stages(journal=journal, resume=resume)
+        connection.close()
+
+        json_data = connection.get_params()
+        extracted_for_validation_json = exctract_validation_data(json_data)
+
+        file_name = None
+        if not connection.config['counters_only']:
+            file_name = "dna-{0}-{1}.json".format(host_tag(host), stamp)
+            file_name = write_json_file(file_name, json_data, compression)
+        file_name_validated = "dna-{0}-{1}-extracted.json".format(host_tag(host), stamp)
+        write_json_file(file_name_validated, extracted_for_validation_json)
+        journal.remove()
+    except SystemExit as exit:
+        return {'host': host, 'status': 'failed', 'exit_code': exit.code,
+                'error': sys.stdout.reason() or 'exited with code {0}'.format(exit.code)}
+    except Exception as error:
+        return {'host': host, 'status': 'failed', 'error': str(error)}
+    finally:
+        sys.stdout = output
+
+    return {
+        'host': host,
+        'status': 'done',
+        'json_data': file_name,
+        'extracted_for_validation_json': file_name_validated,
+        'extracted': extracted_for_validation_json,
+    }
+
+def run_fleet(clusters, workers, resume=False, compression=None):
+    """Collect every cluster in parallel, one process per cluster"""
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(collect_cluster, cluster, stamp, resume, compression)
+                   for cluster in clusters]
+        results = [future.result() for future in futures]
+
+    summary_file = "dna-fleet-{0}-summary.json".format(stamp)
+    write_json_file(summary_file, {'clusters': results})
+    return summary_file, results
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="DNA 'In-Use' Activation Check for a fleet of clusters",
+        epilog="example fleet file:" + FLEET_FILE_EXAMPLE,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'fleet_file',
+        help="JSON file with the clusters and their credentials")
+    parser.add_argument(
+        '--workers', type=int, default=4,
+        help="clusters collected at the same time [default 4]")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="skip the stages completed by a previous partial run")
+    parser.add_argument(
+        '--compress', choices=['gzip', 'zstd'],
+        help="compress the collected data files")
+    return check_optional_packages(parser, parser.parse_args())
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    init()
+    clusters = read_fleet_file(arguments.fleet_file)
+    print(Fore.CYAN+"-Starting fleet run on {0} cluster(s)".format(len(clusters))+Fore.RESET)
+    summary_file, results = run_fleet(
+        clusters, arguments.workers, arguments.resume, arguments.compress)
+    for result in results:
+        if result['status'] == 'done':
+            print(Fore.GREEN+"---{host}: {status}".format(**result)+Fore.RESET)
+        else:
+            print(Fore.RED+"---{host}: {status} ({error})".format(**result)+Fore.RESET)
+    print(Fore.CYAN+"---FLEET DONE - Summary saved in file {0}".format(summary_file)+Fore.RESET)
+    deinit()
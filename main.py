@@ -25,11 +25,17 @@ __version__ = "0.1.0"
 __copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
-from dnacbackend import DNACSession
+from dnacbackend import DNACSession, StageJournal
+from dnacexport import write_json_stream, read_json_stream
+import dnacexport
+from dnacmodel import fabric_site
 from colorama import init, deinit, Fore, Back, Style
+import argparse
+import getpass
 import json
 import time
 import os
+import re
 import sys
 
 WELCOME = """
@@ -66,16 +72,75 @@ only counters, fabric site name and executer name and cco id (for identification
 It is generated localy and can be deleted.{tfend}
 """
 
+END_COUNTERS_ONLY = """
+
+{tf}Script has finished sucessfully!
+Please submit
+
+    {extracted_for_validation_json}
+    {swim_file}
+file/s to
+
+    emearsupport-dnac-activation@cisco.com
+
+for validation.
+
+DISCLAIMER
+`{extracted_for_validation_json}` does not containg any sensitive data,
+only counters, fabric site name and executer name and cco id (for identification purposes).
+Counters only mode: no other collected data has been kept.{tfend}
+"""
+
+# Collected data files, not the extracted, journal, trace or fleet summary files
+SNAPSHOT_NAME = re.compile(
+    r'^dna-(?!journal-|trace-|fleet-).*(?<!-extracted)(?<!\.chrome)\.json(\.gz|\.zst)?(\.aes)?$')
+
 
 def read_json_file(file_url=None):
     with open(file_url, 'r') as json_file:
         return json.loads(json_file.read())
 
-def write_json_file(file_name=None, json_data=None):
+def write_json_file(file_name=None, json_data=None, compression=None, password=None):
     dir_path = os.path.dirname(os.path.abspath(sys.argv[0]))
     file_path = os.path.join(dir_path, file_name)
-    with open(file_path, 'w') as json_file:
-        json.dump(json_data, json_file)
+    file_path = write_json_stream(file_path, json_data, compression, password)
+    return os.path.basename(file_path)
+
+def ask_export_password():
+    while True:
+        password = getpass.getpass("--Password to encrypt the collected data: ")
+        if password and password == getpass.getpass("--Repeat the password: "):
+            return password
+        print("Passwords are empty or do not match!")
+
+def previous_snapshot(host):
+    """Newest collected data file of host next to the script, None when there is none
+
+    Plain and compressed files are read, encrypted ones are skipped with a
+    warning as they need the password.
+    """
+    dir_path = os.path.dirname(os.path.abspath(sys.argv[0]))
+    names = [name for name in os.listdir(dir_path) if SNAPSHOT_NAME.match(name)]
+    names.sort(key=lambda name: os.path.getmtime(os.path.join(dir_path, name)), reverse=True)
+    for name in names:
+        if name.endswith('.aes') or (name.endswith('.zst') and dnacexport.zstandard is None):
+            print(Fore.YELLOW+"---Skipping {0}, {1}".format(
+                name, 'it is encrypted' if name.endswith('.aes') else "zstandard is not installed")+Fore.RESET)
+            continue
+        try:
+            snapshot = read_json_stream(os.path.join(dir_path, name))
+        except (OSError, ValueError, EOFError):
+            continue
+        if isinstance(snapshot, dict) and snapshot.get('host') == host and 'fabric' in snapshot:
+            return name, snapshot
+    return None, None
+
+def host_tag(host):
+    return host.replace(':', '_').replace('/', '_')
+
+def journal_path(host):
+    dir_path = os.path.dirname(os.path.abspath(sys.argv[0]))
+    return os.path.join(dir_path, "dna-journal-{0}.jsonl".format(host_tag(host)))
 
 def exctract_validation_data(contents):
     result = {}
@@ -89,9 +154,11 @@ def exctract_validation_data(contents):
         'wireless_hosts_count',
         'wireless_hosts_count_via_healthcheck',
         'wired_hosts_count_via_healthcheck',
+        'hosts_via_healthcheck_sampling',
         'fabric_sites_count',
         'golden_images_count',
         'upgrade_readiness_report',
+        'upgrade_readiness_report_sha256',
         'upgrade_images_count'
         ]
 
@@ -103,49 +170,146 @@ def exctract_validation_data(contents):
     result['fabric'] = []
     if 'fabric' in contents.keys():
         for fabric in contents['fabric'].items():
-            if fabric[1]['vn_count'] > 0 and fabric[1]['fabric_details']['domainType'] == 'FABRIC_SITE':
+            site = fabric_site(fabric[1])
+            if site.vn_count > 0 and site.domain_type == 'FABRIC_SITE':
                 result['fabric'].append({
-                    'name': fabric[1]['name'],
-                    'vn_count': fabric[1]['vn_count'],
-                    'ippool': len(fabric[1]['ippool']),
-                    'devices': len(fabric[1]['devices']),
-                    'edge': len(fabric[1]['edge']),
-                    'control': len(fabric[1]['control']),
-                    'border': len(fabric[1]['border']),
+                    'name': site.name,
+                    'vn_count': site.vn_count,
+                    'ippool': site.ip_pool_count,
+                    'devices': site.roles.count('devices'),
+                    'edge': site.roles.count('edge'),
+                    'control': site.roles.count('control'),
+                    'border': site.roles.count('border'),
                 })
 
     return result
 
+def parse_duration(value):
+    """Seconds of a duration like 3600, 90m, 24h or 7d"""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    try:
+        if value[-1:].lower() in units:
+            return int(float(value[:-1]) * units[value[-1].lower()])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid duration: {0}".format(value))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="DNA 'In-Use' Activation Check")
+    parser.add_argument(
+        '--cache', action='store_true',
+        help="reuse API responses cached on disk by a recent run")
+    parser.add_argument(
+        '--cache-ttl', type=int, default=900,
+        help="seconds a cached response stays valid [default 900]")
+    parser.add_argument(
+        '--refresh', action='store_true',
+        help="ignore cached responses but refresh the cache")
+    parser.add_argument(
+        '--resume', action='store_true',
+        help="skip the stages completed by a previous partial run")
+    parser.add_argument(
+        '--compress', choices=['gzip', 'zstd'],
+        help="compress the collected data file")
+    parser.add_argument(
+        '--encrypt', action='store_true',
+        help="AES encrypt the collected data file with a password")
+    parser.add_argument(
+        '--counters-only', action='store_true',
+        help="keep only the validation counters, no full data file is written")
+    parser.add_argument(
+        '--health-lookback', type=parse_duration, default=0,
+        help="sample healthcheck client counts over this period, e.g. 24h or 7d, "
+             "and report the peak [default last 5 minutes only]")
+    parser.add_argument(
+        '--health-samples', type=int, default=48,
+        help="healthcheck windows sampled over the lookback [default 48]")
+    parser.add_argument(
+        '--drop-raw-output', action='store_true',
+        help="keep only the counts parsed from the show command outputs")
+    parser.add_argument(
+        '--delta', action='store_true',
+        help="take fabric sites unchanged since the last dna-<date>.json of this host from it")
+    parser.add_argument(
+        '--trace', action='store_true',
+        help="record every request and stage, write JSON and Chrome traces and print a summary")
+    arguments = parser.parse_args()
+    if arguments.encrypt and arguments.resume:
+        # the journal would keep the collected data unencrypted
+        parser.error("--resume cannot be used with --encrypt, encrypted runs keep no journal")
+    return check_optional_packages(parser, arguments)
+
+def check_optional_packages(parser, arguments):
+    """Stop before collecting when an option needs a package that is not installed"""
+    if arguments.compress == 'zstd' and dnacexport.zstandard is None:
+        parser.error("--compress zstd requires the 'zstandard' package (pip install zstandard)")
+    if getattr(arguments, 'encrypt', False) and dnacexport.pyAesCrypt is None:
+        parser.error("--encrypt requires the 'pyAesCrypt' package (pip install pyAesCrypt)")
+    return arguments
+
+def session_config(arguments):
+    return {
+        'cache_enabled': arguments.cache or arguments.refresh,
+        'cache_bypass': arguments.refresh,
+        'cache_ttl': arguments.cache_ttl,
+        'counters_only': arguments.counters_only,
+        'trace': arguments.trace,
+        'keep_raw_output': not arguments.drop_raw_output,
+        'health_lookback': arguments.health_lookback,
+        'health_samples': arguments.health_samples,
+    }
+
+def write_trace(connection):
+    dir_path = os.path.dirname(os.path.abspath(sys.argv[0]))
+    file_path = os.path.join(dir_path, "dna-trace-{0}.json".format(time.strftime("%Y%m%d-%H%M%S")))
+    file_path, chrome_path = connection.tracer.write(file_path)
+    print(connection.tracer.summary())
+    print(Fore.CYAN+"---TRACE DONE - Saved in files {0} and {1}".format(
+        os.path.basename(file_path), os.path.basename(chrome_path))+Fore.RESET)
+
 if __name__ == "__main__":
+    arguments = parse_arguments()
+    export_password = None
     init()
     print(WELCOME.format(tf=Fore.MAGENTA, tfend=Style.RESET_ALL))
     print("-Welcome - Please enter the following information:")
 
+    journal = None
+    connection = None
     try:
 
-        connection = DNACSession()
-        print(Fore.CYAN+'-Starting case: ASSURANCE'+Fore.RESET)
-        connection.count_hosts()
-        connection.count_network_devices_inventory()
-
-        print(Fore.CYAN+'-Starting case: SDA FABRIC'+Fore.RESET)
-        connection.fabric_domains_transits()
-        connection.fabric_inventory()
-        # connection.fabric_summary()
-        connection.show_commands()
-
-        print(Fore.CYAN+'-Starting case: SWIM'+Fore.RESET)
-        connection.count_images()
-        connection.run_upgrade_report()
-        connection.count_image_update_status()
+        connection = DNACSession(config=session_config(arguments))
+        if arguments.encrypt:
+            export_password = ask_export_password()
+        if arguments.delta:
+            snapshot_name, snapshot = previous_snapshot(connection.host)
+            if snapshot is None:
+                print(Fore.YELLOW+"---No previous data file of {0}, collecting everything".format(connection.host)+Fore.RESET)
+            else:
+                print(Fore.CYAN+"---Delta against {0}".format(snapshot_name)+Fore.RESET)
+                connection.set_previous_snapshot(snapshot, snapshot_name)
+        print(Fore.CYAN+'-Starting cases: ASSURANCE, SDA FABRIC, SWIM'+Fore.RESET)
+        if not arguments.encrypt:
+            journal = StageJournal(journal_path(connection.host), connection.host)
+        connection.run_stages(journal=journal, resume=arguments.resume)
+
+        stats = connection.connection_stats()
+        print(Fore.CYAN+"-HTTP requests: {requests}, connections opened: {connections}, reused: {reused} ({reuse_ratio:.0%})".format(**stats)+Fore.RESET)
+        connection.close()
+        if arguments.trace:
+            write_trace(connection)
 
         json_data = connection.get_params()
         print(Fore.CYAN+'-Extracting data for validation [counters only]'+Fore.RESET)
         extracted_for_validation_json = exctract_validation_data(json_data)
 
-        file_name = "dna-{0}.json".format(time.strftime("%Y%m%d-%H%M%S"))
-        write_json_file(file_name, json_data)
-        print(Fore.CYAN+"---COLLECTION DONE - Data saved in file {0}".format(file_name)+Fore.RESET)
+        file_name = None
+        if not arguments.counters_only:
+            file_name = "dna-{0}.json".format(time.strftime("%Y%m%d-%H%M%S"))
+            file_name = write_json_file(
+                file_name, json_data, arguments.compress, export_password)
+            print(Fore.CYAN+"---COLLECTION DONE - Data saved in file {0}".format(file_name)+Fore.RESET)
 
         file_name_validated = "dna-{0}-extracted.json".format(time.strftime("%Y%m%d-%H%M%S"))
         write_json_file(file_name_validated, extracted_for_validation_json)
@@ -156,16 +320,22 @@ if __name__ == "__main__":
         else:
             swim_file = ""
 
-        print(END.format(
+        print((END_COUNTERS_ONLY if arguments.counters_only else END).format(
             extracted_for_validation_json=file_name_validated,
             swim_file=swim_file,
             json_data=file_name,
             tf=Fore.MAGENTA,
             tfend=Style.RESET_ALL
         ))
+        if journal:
+            journal.remove()
         print('Press any key to finish')
         deinit()
         input()
     except SystemExit as e:
+        if arguments.trace and connection:
+            write_trace(connection)
+        if journal:
+            print(Fore.YELLOW+"Completed stages are kept, run again with --resume to continue"+Fore.RESET)
         print('Press enter to exit...')
         deinit()
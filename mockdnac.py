@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Mock DNA Center Server.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+__author__ = "Octavian Preda", "Wojciech Rog"
+__email__ = "opreda@cisco.com", "wrog@cisco.com"
+__version__ = "0.1.0"
+__copyright__ = "Copyright (c) 2019 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import base64
+import collections
+import itertools
+import json
+import math
+import random
+import ssl
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Size of the synthetic data set at scale 1
+BASE_DEVICES = 200
+BASE_HOSTS = 2000
+BASE_FABRIC_SITES = 5
+BASE_IMAGES = 20
+
+DEVICE_FAMILIES = (
+    'Unified AP',
+    'Unified AP',
+    'Unified AP',
+    'Switches and Hubs',
+    'Switches and Hubs',
+    'Routers',
+    'Wireless Controller',
+)
+
+SHOW_VRF = """  Name                             Default RD            Protocols   Interfaces
+{rows}"""
+SHOW_VLAN = """
+VLAN Name                             Status    Ports
+---- -------------------------------- --------- -------------------------------
+{rows}"""
+SHOW_LISP_SITE_SUMMARY = """
+----------- IPv4 ----------- ----------- IPv6 -----------
+Site name            Configured Registered Incons Configured Registered Incons
+{rows}
+Number of configured sites:                     {count}
+Number of registered sites:                     {count}"""
+SHOW_LISP_SESSION = """
+Sessions for VRF default, total: {total}, established: {up}
+Peer                           State      Up/Down        In/Out    Users
+{rows}"""
+
+
+class MockData():
+    """Synthetic DNA Center data set, its size grows with the scale"""
+    def __init__(self, devices=BASE_DEVICES, hosts=BASE_HOSTS,
+                 fabric_sites=BASE_FABRIC_SITES, images=BASE_IMAGES, seed=0):
+        randomizer = random.Random(seed)
+        self.devices = [{
+            'id': 'device-{0}'.format(index),
+            'hostname': 'device-{0}.example.com'.format(index),
+            'family': DEVICE_FAMILIES[index % len(DEVICE_FAMILIES)],
+            'managementIpAddress': '10.{0}.{1}.{2}'.format(
+                index // 65536 % 256, index // 256 % 256, index % 256),
+            'softwareVersion': '16.12.{0}'.format(index % 5),
+        } for index in range(devices)]
+
+        self.hosts = [{
+            'id': 'host-{0}'.format(index),
+            'label': 'host-{0}'.format(index),
+            'deviceType': 'wireless' if randomizer.random() < 0.6 else 'wired',
+            'ip': '172.{0}.{1}.{2}'.format(
+                index // 65536 % 256, index // 256 % 256, index % 256),
+            'nodeType': 'HOST',
+        } for index in range(hosts)]
+
+        self.domains = []
+        self.device_info = []
+        fabric_devices = [device for device in self.devices
+                          if device['family'] in ('Switches and Hubs', 'Routers')]
+        for index in range(fabric_sites):
+            site_id = 'site-{0}'.format(index)
+            self.domains.append({
+                'id': 'fabric-site-{0}'.format(index),
+                'name': 'Global/Site-{0}'.format(index),
+                'domainType': 'FABRIC_SITE',
+                'siteId': site_id,
+                'instanceVersion': 1,
+                'lastUpdateTime': 1560000000000,
+                'virtualNetwork': [{'idRef': 'vn-{0}'.format(vn)} for vn in range(1 + index % 4)],
+            })
+            for position, device in enumerate(fabric_devices[index::fabric_sites]):
+                roles = ['EDGENODE']
+                if position == 0:
+                    roles = ['MAPSERVER', 'BORDERNODE']
+                elif position == 1:
+                    roles = ['EDGENODE', 'BORDERNODE']
+                self.device_info.append({
+                    'id': 'deviceinfo-{0}'.format(device['id']),
+                    'networkDeviceId': device['id'],
+                    'siteDeviceList': site_id,
+                    'roles': roles,
+                })
+        self.domains.append({
+            'id': 'fabric-lan', 'name': 'Default LAN Fabric', 'domainType': 'FABRIC_LAN',
+            'instanceVersion': 1, 'lastUpdateTime': 1560000000000, 'virtualNetwork': []})
+        self.domains.append({
+            'id': 'transit', 'name': 'IP Transit', 'domainType': 'TRANSIT',
+            'instanceVersion': 1, 'lastUpdateTime': 1560000000000, 'virtualNetwork': []})
+        self.ip_pools = {
+            domain['siteId']: [{'id': 'pool-{0}-{1}'.format(domain['siteId'], pool),
+                                'ipPoolCidr': '10.{0}.{1}.0/24'.format(site, pool)}
+                               for pool in range(2 + site % 3)]
+            for site, domain in enumerate(self.domains[:fabric_sites])}
+
+        self.images = [{
+            'imageUuid': 'image-{0}'.format(index),
+            'name': 'cat9k_iosxe.16.12.{0}.SPA.bin'.format(index),
+            'isTaggedGolden': index % 4 == 0,
+        } for index in range(images)]
+        self.image_tasks = [{
+            'taskUuid': 'activate-{0}'.format(index),
+            'taskType': 'activate',
+            'taskStatus': 'success' if index % 3 else 'failure',
+        } for index in range(max(devices // 10, 1))]
+
+        self.report = bytes(randomizer.getrandbits(8) for index in range(64 * 1024)) * \
+            max(devices // BASE_DEVICES, 1)
+
+    @classmethod
+    def scaled(cls, scale=1, seed=0):
+        return cls(
+            devices=BASE_DEVICES * scale,
+            hosts=BASE_HOSTS * scale,
+            fabric_sites=BASE_FABRIC_SITES * scale,
+            images=BASE_IMAGES * scale,
+            seed=seed)
+
+    def connected_clients(self, end_time):
+        """Wired and wireless clients connected at end_time (epoch ms), peaking at noon UTC"""
+        hour = end_time / 3600000.0 % 24
+        share = 0.55 + 0.45 * math.cos((hour - 12) / 24 * 2 * math.pi)
+        wireless = sum(1 for host in self.hosts if host['deviceType'] == 'wireless')
+        return int((len(self.hosts) - wireless) * share), int(wireless * share)
+
+    def command_output(self, device_id, command):
+        number = int(device_id.rsplit('-', 1)[1])
+        if command == 'show vrf':
+            rows = ['  {0:<32} {1:<21} {2:<11} {3}'.format(
+                'VN_{0}'.format(vrf), '<not set>', 'ipv4', 'LI0.{0}'.format(4097 + vrf))
+                for vrf in range(1 + number % 4)]
+            rows.append('  {0:<32} {1:<21} {2:<11} {3}'.format(
+                'Mgmt-vrf', '<not set>', 'ipv4,ipv6', 'Gi0/0'))
+            return SHOW_VRF.format(rows='\n'.join(rows))
+        if command == 'show vlan':
+            rows = ['{0:<4} {1:<32} {2:<9} {3}'.format(vlan, 'VLAN{0:04d}'.format(vlan), 'active', '')
+                    for vlan in [1] + list(range(1021, 1021 + 2 + number % 5))]
+            return SHOW_VLAN.format(rows='\n'.join(rows))
+        if command == 'show lisp site summary':
+            rows = ['{0:<20} {1:<10} {2:<10} {3:<6} {4:<10} {5:<10} {6}'.format(
+                'site_{0}'.format(site), 2, 2, 0, 0, 0, 0) for site in range(1 + number % 3)]
+            return SHOW_LISP_SITE_SUMMARY.format(rows='\n'.join(rows), count=len(rows))
+        if command == 'show lisp session':
+            sessions = 2 + number % 4
+            rows = ['{0:<30} {1:<10} {2:<14} {3:<9} {4}'.format(
+                '10.0.{0}.1:4342'.format(session), 'Down' if session == 0 else 'Up',
+                'never' if session == 0 else '1w2d', '20/18', 4) for session in range(sessions)]
+            return SHOW_LISP_SESSION.format(rows='\n'.join(rows), total=sessions, up=sessions - 1)
+        return '% Invalid input detected'
+
+
+class MockDNACServer(ThreadingHTTPServer):
+    """Threaded HTTP server answering the DNA Center API calls used by DNACSession"""
+    daemon_threads = True
+
+    def __init__(self, address, data, latency=0.0, task_duration=1.0, rate_limit=0,
+                 filters=True, paging=True):
+        super().__init__(address, MockDNACHandler)
+        self.data = data
+        self.filters = filters
+        self.paging = paging
+        self.latency = latency
+        self.task_duration = task_duration
+        self.rate_limit = rate_limit
+        self.recent = collections.deque()
+        self.throttled = 0
+        self.tasks = {}
+        self.files = {}
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.responses = {}
+
+    def new_task(self, kind, payload=None):
+        with self.lock:
+            task_id = 'task-{0}'.format(next(self.ids))
+            self.tasks[task_id] = (time.time(), kind, payload)
+        return task_id
+
+    def throttle(self):
+        """True when more than rate_limit requests arrived in the last second"""
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.time()
+            while self.recent and self.recent[0] < now - 1:
+                self.recent.popleft()
+            if len(self.recent) >= self.rate_limit:
+                self.throttled += 1
+                return True
+            self.recent.append(now)
+            return False
+
+    def cached_body(self, key, build):
+        """Serialize the large static responses only once"""
+        with self.lock:
+            if key not in self.responses:
+                self.responses[key] = json.dumps(build()).encode()
+            return self.responses[key]
+
+
+class MockDNACHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        body = data if isinstance(data, bytes) else json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body) if body else None
+
+    def do_POST(self):
+        server = self.server
+        time.sleep(server.latency)
+        path = urlparse(self.path).path
+        payload = self.read_body()
+        if path != '/api/system/v1/auth/token' and server.throttle():
+            return self.send_json({'error': 'Too Many Requests'}, 429, {'Retry-After': '1'})
+
+        if path == '/api/system/v1/auth/token':
+            claims = json.dumps({'exp': int(time.time()) + 3600, 'username': 'mock'}).encode()
+            token = 'mock.{0}.signature'.format(
+                base64.urlsafe_b64encode(claims).decode().rstrip('='))
+            return self.send_json({'Token': token})
+        if path == '/api/v1/network-device-poller/cli/read-request':
+            task_id = server.new_task('command', payload)
+            return self.send_json({'response': {'taskId': task_id, 'url': '/api/v1/task/' + task_id}})
+        if path == '/api/v1/image/upgrade-analysis/file':
+            task_id = server.new_task('report')
+            return self.send_json({'response': {'taskId': task_id, 'url': '/api/v1/task/' + task_id}})
+        if path == '/api/assurance/v1/host/dash/healthdetail':
+            wired, wireless = server.data.connected_clients(payload['typeList']['endTime'])
+            return self.send_json({'response': [{
+                'siteId': '__global__',
+                'scoreDetail': [
+                    {'scoreCategory': {'value': 'WIRED'}, 'clientUniqueCount': wired},
+                    {'scoreCategory': {'value': 'WIRELESS'}, 'clientUniqueCount': wireless},
+                ]}]})
+        self.send_json({'error': 'Unknown API {0}'.format(path)}, 404)
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        time.sleep(server.latency)
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        query = parse_qs(url.query)
+        if server.throttle():
+            return self.send_json({'error': 'Too Many Requests'}, 429, {'Retry-After': '1'})
+
+        if path == '/api/v1/topology/physical-topology':
+            return self.send_json(server.cached_body('hosts', lambda: {
+                'response': {'id': 'topology', 'links': [], 'nodes': data.hosts},
+                'version': '1.0'}))
+        if path == '/api/v1/network-device/count' and server.filters:
+            devices = data.devices
+            if 'family' in query:
+                devices = [device for device in devices if device['family'] == query['family'][0]]
+            return self.send_json({'response': len(devices), 'version': '1.0'})
+        if path == '/api/v1/network-device':
+            if 'offset' in query and server.paging:
+                offset = int(query['offset'][0]) - 1
+                limit = int(query.get('limit', ['500'])[0])
+                return self.send_json({'response': data.devices[offset:offset + limit]})
+            return self.send_json(server.cached_body(
+                'devices', lambda: {'response': data.devices}))
+        if path == '/api/v2/data/customer-facing-service/ConnectivityDomain':
+            return self.send_json({'response': data.domains})
+        if path == '/api/v2/data/customer-facing-service/DeviceInfo':
+            if 'siteDeviceList' in query:
+                site_id = query['siteDeviceList'][0]
+                return self.send_json({'response': [
+                    item for item in data.device_info if item['siteDeviceList'] == site_id]})
+            return self.send_json(server.cached_body(
+                'device_info', lambda: {'response': data.device_info}))
+        if path == '/api/v2/ippool':
+            site_id = query.get('contextvalue', [''])[0]
+            return self.send_json({'response': data.ip_pools.get(site_id, [])})
+        if path.startswith('/api/v1/task/'):
+            return self.get_task(path.rsplit('/', 1)[1])
+        if path.startswith('/api/v1/file/'):
+            return self.get_file(path.rsplit('/', 1)[1])
+        if path == '/api/v1/image/importation':
+            images = data.images
+            if server.filters and 'isTaggedGolden' in query:
+                golden = query['isTaggedGolden'][0] == 'true'
+                images = [image for image in images if image['isTaggedGolden'] == golden]
+            return self.send_json({'response': images})
+        if path == '/api/v1/image/task':
+            tasks = data.image_tasks
+            if server.filters and 'taskStatus' in query:
+                tasks = [task for task in tasks if task['taskStatus'] == query['taskStatus'][0]]
+            return self.send_json({'response': tasks})
+        self.send_json({'error': 'Unknown API {0}'.format(path)}, 404)
+
+    def get_task(self, task_id):
+        server = self.server
+        if task_id not in server.tasks:
+            return self.send_json({'response': {'errorCode': 'NOT_FOUND'}}, 404)
+        started, kind, payload = server.tasks[task_id]
+        task = {'id': task_id, 'startTime': int(started * 1000), 'isError': False}
+        if time.time() - started < server.task_duration:
+            task['progress'] = 'In Progress'
+        elif kind == 'command':
+            file_id = 'command-' + task_id
+            server.files[file_id] = payload
+            task['progress'] = json.dumps({'fileId': file_id})
+            task['endTime'] = int(time.time() * 1000)
+        else:
+            task['progress'] = 'Upgrade analysis report generated'
+            task['additionalStatusURL'] = '/api/v1/file/report-' + task_id
+            task['endTime'] = int(time.time() * 1000)
+        self.send_json({'response': task})
+
+    def get_file(self, file_id):
+        server = self.server
+        if file_id.startswith('report-'):
+            body = server.data.report
+            status = 200
+            requested = self.headers.get('Range')
+            if requested:
+                start = int(requested.split('=')[1].split('-')[0])
+                if start >= len(body):
+                    return self.send_json({'error': 'Range Not Satisfiable'}, 416)
+                body = body[start:]
+                status = 206
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('fileName', 'upgrade-readiness-report.csv')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if file_id not in server.files:
+            return self.send_json({'error': 'File not found'}, 404)
+        payload = server.files[file_id]
+        self.send_json([{
+            'deviceUuid': device_id,
+            'commandResponses': {
+                'SUCCESS': {command: server.data.command_output(device_id, command)
+                            for command in payload['commands']},
+                'FAILURE': {},
+                'BLACKLISTED': {},
+            }} for device_id in payload['deviceUuids']])
+
+
+def serve(data, host='127.0.0.1', port=0, latency=0.0, task_duration=1.0,
+          rate_limit=0, filters=True, certfile=None, keyfile=None, paging=True):
+    """Start a mock server in a background thread and return it"""
+    server = MockDNACServer(
+        (host, port), data, latency, task_duration, rate_limit, filters, paging)
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Mock DNA Center serving synthetic data for offline runs")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0,
+                        help="port to listen on [default any free port]")
+    parser.add_argument('--scale', type=int, default=1,
+                        help="multiplies the base data set size [default 1]")
+    parser.add_argument('--devices', type=int, help="network devices")
+    parser.add_argument('--hosts', type=int, help="wired and wireless hosts")
+    parser.add_argument('--fabric-sites', type=int, help="fabric sites")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added to every response [default 0]")
+    parser.add_argument('--task-duration', type=float, default=1.0,
+                        help="seconds until a task completes [default 1]")
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help="answer 429 above this many requests per second [default off]")
+    parser.add_argument('--no-filters', dest='filters', action='store_false',
+                        help="ignore query filters and have no count endpoints, like older releases")
+    parser.add_argument('--no-paging', dest='paging', action='store_false',
+                        help="ignore offset and limit, return the whole device inventory")
+    parser.add_argument('--certfile', help="serve HTTPS with this certificate")
+    parser.add_argument('--keyfile', help="private key of the certificate")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    data = MockData(
+        devices=arguments.devices or BASE_DEVICES * arguments.scale,
+        hosts=arguments.hosts or BASE_HOSTS * arguments.scale,
+        fabric_sites=arguments.fabric_sites or BASE_FABRIC_SITES * arguments.scale,
+        images=BASE_IMAGES * arguments.scale)
+    server = serve(data, arguments.host, arguments.port, arguments.latency,
+                   arguments.task_duration, arguments.rate_limit, arguments.filters,
+                   arguments.certfile, arguments.keyfile, arguments.paging)
+    print("Mock DNA Center listening on port {0}".format(server.server_port))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
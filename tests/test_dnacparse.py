@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Show Command Parser Tests.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnacparse
+
+# IOS-XE 16.12 fabric edge and control plane outputs
+SHOW_VRF = """\
+  Name                             Default RD            Protocols   Interfaces
+  Campus_VN                        1:4099                ipv4        LI0.4099
+                                                                     Vl1021
+                                                                     Vl1022
+  DEFAULT_VN                       <not set>             ipv4        LI0.4097
+  Guest_VN                         1:4100                ipv4        LI0.4100
+                                                                     Vl1023
+  Mgmt-vrf                         <not set>             ipv4,ipv6   Gi0/0
+"""
+
+SHOW_VLAN = """\
+
+VLAN Name                             Status    Ports
+---- -------------------------------- --------- -------------------------------
+1    default                          active    Gi1/0/2, Gi1/0/3, Gi1/0/5
+                                                Gi1/0/6, Gi1/0/7
+1021 10_0_1_0-Campus_VN               active    Gi1/0/4
+1022 10_0_2_0-Campus_VN               active
+1023 10_0_3_0-Guest_VN                suspended
+2045 AP_VLAN                          active    Gi1/0/1
+1002 fddi-default                     act/unsup
+1003 token-ring-default               act/unsup
+1004 fddinet-default                  act/unsup
+1005 trnet-default                    act/unsup
+
+VLAN Type  SAID       MTU   Parent RingNo BridgeNo Stp  BrdgMode Trans1 Trans2
+---- ----- ---------- ----- ------ ------ -------- ---- -------- ------ ------
+1    enet  100001     1500  -      -      -        -    -        0      0
+1021 enet  101021     1500  -      -      -        -    -        0      0
+1022 enet  101022     1500  -      -      -        -    -        0      0
+1023 enet  101023     1500  -      -      -        -    -        0      0
+2045 enet  102045     1500  -      -      -        -    -        0      0
+1002 fddi  101002     1500  -      -      -        -    -        0      0
+1003 tr    101003     1500  -      -      -        -    -        0      0
+1004 fdnet 101004     1500  -      -      -        ieee -        0      0
+1005 trnet 101005     1500  -      -      -        ibm  -        0      0
+
+Remote SPAN VLANs
+------------------------------------------------------------------------------
+
+
+Primary Secondary Type              Ports
+------- --------- ----------------- ------------------------------------------
+
+"""
+
+SHOW_LISP_SITE_SUMMARY = """\
+                 ----------- IPv4 -----------  ----------- IPv6 -----------
+Site name        Configured Registered Incons  Configured Registered Incons
+site_uci                  3          3      0           0          0      0
+site_guest                1          0      0           1          1      0
+"""
+
+SHOW_LISP_SESSION = """\
+Sessions for VRF default, total: 4, established: 2
+Peer                           State      Up/Down        In/Out    Users
+10.4.14.1:4342                 Up         1w2d           1547/1123  7
+10.4.14.2:4342                 Up         1w2d           1545/1121  7
+10.4.14.3:4342                 Down       00:01:12       0/3        2
+10.4.14.4:4342                 Init       never          0/0        1
+"""
+
+
+class ShowCommandParserTest(unittest.TestCase):
+    def test_show_vrf(self):
+        self.assertEqual(dnacparse.parse_show_vrf(SHOW_VRF), {'vrfs': 4})
+
+    def test_show_vlan(self):
+        self.assertEqual(dnacparse.parse_show_vlan(SHOW_VLAN), {'vlans': 9})
+
+    def test_show_lisp_site_summary_without_total(self):
+        self.assertEqual(
+            dnacparse.parse_show_lisp_site_summary(SHOW_LISP_SITE_SUMMARY), {'lisp_sites': 2})
+
+    def test_show_lisp_site_summary_with_total(self):
+        output = SHOW_LISP_SITE_SUMMARY + (
+            "\nNumber of configured sites:                     5\n"
+            "Number of registered sites:                     2\n")
+        self.assertEqual(dnacparse.parse_show_lisp_site_summary(output), {'lisp_sites': 5})
+
+    def test_show_lisp_session(self):
+        self.assertEqual(
+            dnacparse.parse_show_lisp_session(SHOW_LISP_SESSION),
+            {'lisp_sessions_up': 2, 'lisp_sessions_down': 2})
+
+    def test_parse_command_file_without_raw(self):
+        file = [{
+            'deviceUuid': 'edge-1',
+            'commandResponses': {
+                'SUCCESS': {'show vrf': SHOW_VRF, 'show vlan': SHOW_VLAN, 'show version': 'IOS-XE'},
+                'FAILURE': {'show lisp session': 'Invalid input detected'},
+                'BLACKLISTED': {},
+            },
+        }, {
+            'deviceUuid': 'border-1',
+            'commandResponses': {'SUCCESS': {}, 'FAILURE': {}, 'BLACKLISTED': {}},
+        }]
+        dnacparse.parse_command_file(file, keep_raw=False)
+        self.assertEqual(file[0]['parsed'], {'vrfs': 4, 'vlans': 9})
+        self.assertEqual(file[0]['commandResponses']['SUCCESS'],
+                         {'show vrf': None, 'show vlan': None, 'show version': 'IOS-XE'})
+        self.assertEqual(file[0]['commandResponses']['FAILURE'],
+                         {'show lisp session': 'Invalid input detected'})
+        self.assertNotIn('parsed', file[1])
+        self.assertEqual(dnacparse.total_counts(file), {'vrfs': 4, 'vlans': 9})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker Device Inventory Paging Tests.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dnacbackend import DNACSession
+import mockdnac
+
+
+def create_session(server, output_dir, **config):
+    config.update({
+        'scheme': 'http',
+        'ask_for_permission': False,
+        'token_cache': False,
+        'output_dir': output_dir,
+    })
+    return DNACSession(
+        host='127.0.0.1', port=server.server_port, username='test', password='test',
+        executer_name='test', executer_cco='test', config=config)
+
+
+class InventoryPagingTest(unittest.TestCase):
+    devices = 50
+
+    def inventory(self, paging, page_size):
+        server = mockdnac.serve(mockdnac.MockData(devices=self.devices), paging=paging)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        with tempfile.TemporaryDirectory() as output_dir, \
+                contextlib.redirect_stdout(io.StringIO()):
+            session = create_session(server, output_dir, inventory_page_size=page_size)
+            try:
+                return session.get_network_devices_inventory()
+            finally:
+                session.close()
+
+    def assertWholeInventory(self, devices):
+        self.assertEqual(len(devices), self.devices)
+        self.assertEqual(len(set(device['id'] for device in devices)), self.devices)
+
+    def test_paged(self):
+        for page_size in (7, 50, 500):
+            with self.subTest(page_size=page_size):
+                self.assertWholeInventory(self.inventory(True, page_size))
+
+    def test_ignored_offset_within_limit(self):
+        self.assertWholeInventory(self.inventory(False, 500))
+
+    def test_ignored_offset_above_limit(self):
+        self.assertWholeInventory(self.inventory(False, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""activationchecker iter_json_array Tests.
+
+Copyright (c) 2019 Cisco and/or its affiliates.
+
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+
+               https://developer.cisco.com/docs/licenses
+
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+
+"""
+
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dnacbackend import iter_json_array
+
+
+def split(body, *positions):
+    """body as bytes chunks cut at the given positions"""
+    data = body.encode('utf-8')
+    bounds = [0] + list(positions) + [len(data)]
+    return [data[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+    document = {
+        'version': '1.0',
+        'response': [15000000000.0, -2e-3, 7, True, None, 'a,]"b',
+                     {'name': 'VN_1', 'ids': [1, 2]}, [], 'zażółć'],
+    }
+
+    def test_every_chunk_boundary(self):
+        body = json.dumps(self.document, ensure_ascii=False)
+        size = len(body.encode('utf-8'))
+        for position in range(size + 1):
+            with self.subTest(position=position):
+                self.assertEqual(
+                    list(iter_json_array(split(body, position), 'response')),
+                    self.document['response'])
+
+    def test_one_byte_chunks(self):
+        body = json.dumps(self.document['response'])
+        chunks = [bytes([byte]) for byte in body.encode('utf-8')]
+        self.assertEqual(list(iter_json_array(chunks, None)), self.document['response'])
+
+    def test_number_split_before_fraction(self):
+        chunks = split('{"response": [15000000000.0, 1e10]}', 25, 32)
+        self.assertEqual(list(iter_json_array(chunks, 'response')), [15000000000.0, 1e10])
+
+    def test_null_is_empty(self):
+        self.assertEqual(list(iter_json_array(split('{"response": null}', 15), 'response')), [])
+
+    def test_missing_key(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(split('{"error": "not found"}', 5), 'response'))
+
+    def test_truncated_body(self):
+        body = '{"response": [1, 2, 3'
+        for position in range(len(body) + 1):
+            with self.subTest(position=position):
+                with self.assertRaises(ValueError):
+                    list(iter_json_array(split(body, position), 'response'))
+
+    def test_garbage_after_item(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(split('[1, 2 3]'), None))
+
+    def test_not_an_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(split('{"response": []}'), None))
+
+
+if __name__ == '__main__':
+    unittest.main()